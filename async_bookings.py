@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Dict, Any, Optional, Tuple
+import bookings
+import export
+import keyboards
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Как часто переносить прошедшие месяцы в архив (только для BOOKINGS_STORAGE=partitioned)
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("BOOKINGS_ARCHIVE_INTERVAL_HOURS", "24"))
+# Окно групповой фиксации, мс: изменения, пришедшие за это время, записываются на диск
+# одним fsync и подтверждаются вместе; 0 — запись после каждого изменения
+GROUP_COMMIT_MS = float(os.getenv("BOOKINGS_GROUP_COMMIT_MS", "5"))
+# Вся работа с хранилищем выполняется в одном выделенном потоке: обработчики
+# не блокируют цикл событий, а индекс в памяти никогда не читается во время записи.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bookings-io")
+# Изменения сериализуются, чтобы проверка дубликата и добавление шли одной операцией
+_write_lock = asyncio.Lock()
+
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args))
+
+
+class GroupCommit:
+    """Групповая фиксация изменений.
+
+    Первое изменение открывает окно; все изменения, выполненные до его закрытия,
+    записываются на диск одним bookings.flush(), и только после этого их
+    вызывающие получают ответ.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._pending: Optional[asyncio.Future] = None
+        self._waiters = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self) -> None:
+        """Дожидается, пока уже выполненные изменения будут надёжно записаны"""
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().create_future()
+            self._task = asyncio.create_task(self._commit(self._pending))
+        self._waiters += 1
+        await asyncio.shield(self._pending)
+
+    async def _commit(self, future: asyncio.Future) -> None:
+        await asyncio.sleep(self.window)
+        # Изменения после этой точки попадут уже в следующую группу
+        self._pending = None
+        waiters, self._waiters = self._waiters, 0
+        try:
+            await _run(bookings.flush)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # ошибку получат ожидающие; не логируем её повторно
+        else:
+            future.set_result(None)
+        metrics.inc('storage.commits')
+        metrics.inc('storage.committed_writes', waiters)
+
+
+_group_commit = GroupCommit(GROUP_COMMIT_MS / 1000)
+
+
+async def _write(func, *args):
+    """Изменение под общей блокировкой; ответ — после записи на диск"""
+    async with _write_lock:
+        result = await _run(func, *args)
+    if GROUP_COMMIT_MS > 0:
+        await _group_commit.wait()
+    return result
+
+
+async def warm_up() -> None:
+    """Загружает индекс бронирований заранее, чтобы первый запрос не ждал чтения с диска"""
+    await _run(bookings.load_index)
+    if GROUP_COMMIT_MS > 0:
+        await _run(bookings.set_group_commit, True)
+
+
+async def map_bookings(func: Callable[[Dict[str, Any]], Any], date_from: Optional[str] = None) -> List[Any]:
+    """Применяет func к бронированиям на date_from и позже в потоке хранилища; None отбрасываются"""
+    return await _run(lambda: [r for r in map(func, bookings.iter_bookings(date_from)) if r is not None])
+
+
+async def storage_shared() -> bool:
+    """Хранилище могут одновременно использовать другие процессы"""
+    return await _run(lambda: bookings.get_storage().shared)
+
+
+def shutdown() -> None:
+    """Дожидается завершения операций и закрывает хранилище"""
+    _executor.shutdown(wait=True)
+    bookings.close_storage()
+
+
+async def load_bookings() -> List[Dict[str, Any]]:
+    return await _run(bookings.load_bookings)
+
+
+async def save_bookings(bookings_list: List[Dict[str, Any]]) -> None:
+    await _write(bookings.save_bookings, bookings_list)
+
+
+async def add_booking(booking_data: Dict[str, Any]) -> Dict[str, Any]:
+    return await _write(bookings.add_booking, booking_data)
+
+
+async def add_booking_if_new(booking_data: Dict[str, Any], capacity: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Добавляет бронирование, если у пользователя ещё нет брони на этот слот. Иначе возвращает None.
+
+    Проверка и добавление выполняются одной операцией; при нехватке мест — SlotFullError.
+    """
+    return await _write(bookings.add_booking_if_new, booking_data, capacity)
+
+
+async def get_booking_by_id(booking_id: int) -> Optional[Dict[str, Any]]:
+    return await _run(bookings.get_booking_by_id, booking_id)
+
+
+async def get_bookings_by_date(date: str) -> List[Dict[str, Any]]:
+    return await _run(bookings.get_bookings_by_date, date)
+
+
+async def get_all_bookings() -> List[Dict[str, Any]]:
+    return await _run(bookings.get_all_bookings)
+
+
+async def query_bookings(date: Optional[str] = None, status: Optional[str] = None,
+                         offset: int = 0, limit: int = 10) -> Tuple[int, List[Dict[str, Any]]]:
+    return await _run(bookings.query_bookings, date, status, offset, limit)
+
+
+async def find_bookings(offset: int = 0, limit: int = 10, **criteria) -> Tuple[int, List[Dict[str, Any]]]:
+    """Поиск бронирований; условия — именованные аргументы bookings.find_bookings"""
+    return await _run(partial(bookings.find_bookings, offset=offset, limit=limit, **criteria))
+
+
+async def export_bookings(path: str, fmt: str = 'csv', date_from: Optional[str] = None,
+                          date_to: Optional[str] = None, status: Optional[str] = None) -> int:
+    """Выгружает бронирования в файл CSV или XLSX. Возвращает число записей."""
+    writer = export.write_xlsx if fmt == 'xlsx' else export.write_csv
+    # Строки собираются целиком в потоке хранилища, поэтому изменения не вклиниваются
+    # в перебор индекса; файл пишется в отдельном потоке и хранилище не занимает
+    rows = await _run(lambda: export.rows(bookings.iter_bookings(date_from, date_to, status)))
+    return await asyncio.to_thread(writer, rows, path)
+
+
+async def update_booking_status(booking_id: int, status: str) -> bool:
+    return await _write(bookings.update_booking_status, booking_id, status)
+
+
+async def update_booking_status_many(booking_ids: List[int], status: str,
+                                     capacity: Optional[Callable[[str], int]] = None
+                                     ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Меняет статус нескольких бронирований; возвращает изменённые и не поместившиеся на отправление"""
+    return await _write(bookings.update_booking_status_many, booking_ids, status, capacity)
+
+
+async def get_departure_bookings(location: str, date: str, time: str) -> List[Dict[str, Any]]:
+    return await _run(bookings.get_departure_bookings, location, date, time)
+
+
+async def update_departure_status(location: str, date: str, time: str, status: str) -> List[Dict[str, Any]]:
+    """Меняет статус всех активных бронирований отправления; возвращает изменённые"""
+    return await _write(bookings.update_departure_status, location, date, time, status)
+
+
+async def get_user_bookings(user_id, upcoming_only: bool = False) -> List[Dict[str, Any]]:
+    return await _run(bookings.get_user_bookings, user_id, upcoming_only)
+
+
+async def cancel_user_booking(booking_id: int, user_id) -> Optional[Dict[str, Any]]:
+    """Отмена бронирования клиентом; None, если бронирование не его, уже отменено или тур прошёл"""
+    return await _write(bookings.cancel_user_booking, booking_id, user_id)
+
+
+async def booking_exists(user_id, location, date, time) -> bool:
+    return await _run(bookings.booking_exists, user_id, location, date, time)
+
+
+async def get_seats_taken(location: str, date: str, time: str) -> int:
+    return await _run(bookings.get_seats_taken, location, date, time)
+
+
+# Клавиатуры показывают свободные места и читают индекс, поэтому тоже строятся в потоке хранилища
+
+async def seats_left(location: str, date: str, time: str) -> int:
+    return await _run(keyboards.seats_left, location, date, time)
+
+
+async def calendar_keyboard(location: Optional[str]):
+    return await _run(keyboards.calendar_keyboard, location)
+
+
+async def time_keyboard(location: Optional[str], date: str):
+    return await _run(keyboards.time_keyboard, location, date)
+
+
+async def delete_all_bookings() -> None:
+    await _write(bookings.delete_all_bookings)
+
+
+async def delete_booking_by_id(booking_id: int) -> bool:
+    return await _write(bookings.delete_booking_by_id, booking_id)
+
+
+async def archive_past_tours() -> int:
+    return await _write(bookings.archive_past_tours)
+
+
+async def archive_periodically(interval_hours: float = ARCHIVE_INTERVAL_HOURS) -> None:
+    """Фоновая задача: при запуске и затем раз в interval_hours архивирует прошедшие месяцы"""
+    while True:
+        try:
+            count = await archive_past_tours()
+            if count:
+                logger.info("В архив перенесено бронирований: %d", count)
+        except Exception:
+            logger.exception("Не удалось перенести бронирования в архив")
+        await asyncio.sleep(interval_hours * 3600)
@@ -0,0 +1,237 @@
+"""Бенчмарк операций bookings.py в зависимости от размера хранилища.
+
+Для каждого режима хранения и размера (по умолчанию 1k, 10k, 100k и 1M бронирований)
+в отдельном процессе создаётся синтетическое хранилище, затем в новом процессе
+замеряются холодный старт (до загрузки индекса и до первого подтверждённого
+бронирования), add_booking, booking_exists, get_bookings_by_date,
+update_booking_status и delete_booking_by_id, пиковый RSS и байты, записанные
+на одно изменение. Результаты пишутся в JSON вместе с хешем коммита, чтобы
+сравнивать их между версиями.
+
+Пример:
+    python3 bench_bookings.py --sizes 1000 10000 --storage journal sqlite --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+from storage import STORAGE_MODES  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+LOCATIONS = ("Вершины Феодосии", "Белая Скала", "Арпатские водопады", "Меганом и мысы Судака")
+TIMES = ("08:00", "09:00", "13:00", "14:00", "17:00")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк операций bookings.py")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="размеры хранилища")
+    parser.add_argument('--storage', nargs='+', choices=STORAGE_MODES, default=list(STORAGE_MODES),
+                        help="режимы хранения")
+    parser.add_argument('--reads', type=int, default=1000, help="число замеров для операций чтения")
+    parser.add_argument('--writes', type=int, default=20, help="число замеров для каждой операции записи")
+    parser.add_argument('--output', default="bench_results.json", help="файл с результатами (JSON)")
+    parser.add_argument('--cold-start-target', type=float, default=5.0,
+                        help="допустимое время до первого бронирования после запуска, с")
+    # Служебные режимы дочерних процессов
+    parser.add_argument('--seed-child', nargs=3, metavar=('STORAGE', 'SIZE', 'WORKDIR'), help=argparse.SUPPRESS)
+    parser.add_argument('--measure-child', nargs=3, metavar=('STORAGE', 'SIZE', 'WORKDIR'), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def synthetic_booking(i: int, rng: random.Random, start: datetime) -> Dict:
+    user_id = rng.randint(1, 10 ** 9)
+    return {
+        'id': i,
+        'location': rng.choice(LOCATIONS),
+        'date': (start + timedelta(days=rng.randint(0, 364))).strftime("%d.%m.%Y"),
+        'time': rng.choice(TIMES),
+        'people': str(rng.randint(1, 6)),
+        'user_id': user_id,
+        'username': f"user{user_id}",
+        'first_name': f"Имя{i}",
+        'chat_id': user_id,
+        'timestamp': start.isoformat(),
+        'status': rng.choice(('new', 'new', 'new', 'confirmed', 'cancelled')),
+    }
+
+
+def set_storage_env(mode: str, workdir: str) -> None:
+    os.chdir(workdir)
+    os.environ["BOOKINGS_STORAGE"] = mode
+    # Журнал не должен уплотняться посреди замера записей
+    os.environ.setdefault("BOOKINGS_JOURNAL_COMPACT_EVERY", "1000000000")
+
+
+def seed_child(mode: str, size: int, workdir: str) -> None:
+    """Создаёт хранилище с size бронированиями"""
+    set_storage_env(mode, workdir)
+    import bookings
+    rng = random.Random(size)
+    start = datetime(2025, 1, 1)
+    bookings.save_bookings([synthetic_booking(i, rng, start) for i in range(1, size + 1)])
+    bookings.close_storage()
+
+
+def read_wchar() -> int:
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    samples_us = sorted(s * 1e6 for s in samples)
+    return {
+        'n': len(samples_us),
+        'mean_us': statistics.fmean(samples_us),
+        'p50_us': samples_us[len(samples_us) // 2],
+        'p95_us': samples_us[min(len(samples_us) - 1, int(len(samples_us) * 0.95))],
+    }
+
+
+def measure_child(mode: str, size: int, workdir: str, reads: int, writes: int) -> Dict:
+    """Замеряет операции на заранее созданном хранилище"""
+    set_storage_env(mode, workdir)
+    rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    import bookings
+    bookings.load_index()
+    cold_start = time.perf_counter() - t0
+    # Первое бронирование после запуска — то, что увидит клиент после рестарта бота
+    first = synthetic_booking(0, random.Random(-1), datetime(2025, 1, 1))
+    del first['id'], first['timestamp'], first['status']
+    bookings.add_booking_if_new(first, capacity=10 ** 9)
+    first_booking = time.perf_counter() - t0
+
+    rng = random.Random(1)
+    existing = bookings.get_all_bookings()
+    sample = [existing[rng.randrange(len(existing))] for _ in range(reads)] if existing else []
+    dates = [b['date'] for b in sample]
+    del existing
+
+    results = {'cold_start_s': cold_start, 'first_booking_s': first_booking}
+
+    timings = []
+    for b in sample:
+        t = time.perf_counter()
+        bookings.booking_exists(b['user_id'], b['location'], b['date'], b['time'])
+        timings.append(time.perf_counter() - t)
+    results['booking_exists'] = summarize(timings)
+
+    timings = []
+    for date in dates:
+        t = time.perf_counter()
+        bookings.get_bookings_by_date(date)
+        timings.append(time.perf_counter() - t)
+    results['get_bookings_by_date'] = summarize(timings)
+
+    def measure_writes(name, func, args_list):
+        timings = []
+        written = []
+        for args in args_list:
+            w = read_wchar()
+            t = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - t)
+            written.append(read_wchar() - w)
+        stats = summarize(timings)
+        stats['bytes_written_per_op'] = statistics.fmean(written) if written else 0
+        results[name] = stats
+
+    start = datetime(2025, 1, 1)
+    new_bookings = [synthetic_booking(0, rng, start) for _ in range(writes)]
+    for b in new_bookings:
+        del b['id'], b['timestamp'], b['status']
+    measure_writes('add_booking', bookings.add_booking, [(b,) for b in new_bookings])
+    ids = [b['id'] for b in new_bookings]
+    measure_writes('update_booking_status', bookings.update_booking_status, [(i, 'confirmed') for i in ids])
+    measure_writes('delete_booking_by_id', bookings.delete_booking_by_id, [(i,) for i in ids])
+    bookings.close_storage()
+
+    results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['rss_before_import_kb'] = rss_before_kb
+    return results
+
+
+def run_child(flag: str, mode: str, size: int, workdir: str, args) -> str:
+    cmd = [sys.executable, os.path.abspath(__file__), flag, mode, str(size), workdir,
+           '--reads', str(args.reads), '--writes', str(args.writes)]
+    return subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=REPO_DIR).stdout
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=REPO_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    args = parse_args()
+    if args.seed_child:
+        mode, size, workdir = args.seed_child
+        seed_child(mode, int(size), workdir)
+        return
+    if args.measure_child:
+        mode, size, workdir = args.measure_child
+        print(json.dumps(measure_child(mode, int(size), workdir, args.reads, args.writes)))
+        return
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': datetime.now().isoformat(),
+        'cold_start_target_s': args.cold_start_target,
+        'results': [],
+    }
+    for mode in args.storage:
+        for size in args.sizes:
+            workdir = tempfile.mkdtemp(prefix=f"jeeptour-bench-{mode}-{size}-")
+            try:
+                run_child('--seed-child', mode, size, workdir, args)
+                result = json.loads(run_child('--measure-child', mode, size, workdir, args))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            result.update({'storage': mode, 'size': size,
+                           'cold_start_target_met': result['first_booking_s'] <= args.cold_start_target})
+            report['results'].append(result)
+            print(
+                f"{mode:<8} {size:>8}: старт {result['cold_start_s']:.3f} с, "
+                f"первое бронирование через {result['first_booking_s']:.3f} с"
+                f"{'' if result['cold_start_target_met'] else ' (дольше цели)'}, "
+                f"exists {result['booking_exists']['mean_us']:.1f} мкс, "
+                f"by_date {result['get_bookings_by_date']['mean_us']:.1f} мкс, "
+                f"add {result['add_booking']['mean_us'] / 1000:.2f} мс "
+                f"({result['add_booking']['bytes_written_per_op']:.0f} Б), "
+                f"status {result['update_booking_status']['mean_us'] / 1000:.2f} мс, "
+                f"delete {result['delete_booking_by_id']['mean_us'] / 1000:.2f} мс, "
+                f"RSS {result['peak_rss_kb'] / 1024:.0f} МБ",
+                flush=True,
+            )
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
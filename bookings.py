@@ -1,81 +1,573 @@
-import json
+import gc
 import os
 from datetime import datetime
-from typing import List, Dict, Any
+from itertools import islice
+from typing import Callable, List, Dict, Any, Iterator, Optional, Tuple
+from storage import BookingStorage, create_storage, SlotFullError
+from metrics import metrics
+from search import SearchIndex
 
 BOOKINGS_FILE = "bookings.json"
+JOURNAL_FILE = "bookings.journal"
+DB_FILE = os.getenv("BOOKINGS_DB_FILE", "bookings.db")
+# Режим хранения: "json" — перезапись всего файла, "journal" — дозапись изменений,
+# "sqlite" — база SQLite с индексами (при первом запуске переносит bookings.json),
+# "partitioned" — файлы по месяцам тура с архивом прошедших месяцев
+STORAGE_MODE = os.getenv("BOOKINGS_STORAGE", "json")
+JOURNAL_COMPACT_EVERY = int(os.getenv("BOOKINGS_JOURNAL_COMPACT_EVERY", "1000"))
+PARTITION_DIR = os.getenv("BOOKINGS_PARTITION_DIR", "bookings_partitions")
+# Формат снимка журнала: "binary" — bookings.snap с контрольной суммой, "json" — bookings.json
+SNAPSHOT_FORMAT = os.getenv("BOOKINGS_SNAPSHOT_FORMAT", "binary")
+SNAPSHOT_FILE = "bookings.snap"
 
-def load_bookings() -> List[Dict[str, Any]]:
-    """Загружает список бронирований из файла"""
-    if os.path.exists(BOOKINGS_FILE):
+# Статусы, при которых бронирование занимает места в джипе
+ACTIVE_STATUSES = ('new', 'confirmed')
+
+# Хранилище открывается при первом обращении, а не при импорте модуля: импорт не берёт
+# блокировку файлов и не переносит bookings.json в базу
+_storage: Optional[BookingStorage] = None
+
+
+def get_storage() -> BookingStorage:
+    """Возвращает хранилище бронирований, открывая его при первом обращении"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage(STORAGE_MODE, BOOKINGS_FILE, JOURNAL_FILE, DB_FILE, JOURNAL_COMPACT_EVERY,
+                                  PARTITION_DIR, SNAPSHOT_FILE if SNAPSHOT_FORMAT == "binary" else None)
+    return _storage
+
+
+class BookingIndex:
+    """Индекс бронирований в памяти процесса.
+
+    Загружается из хранилища один раз и обновляется при каждом изменении,
+    поэтому чтение (проверка дубликата, поиск по ID и по дате, занятые места)
+    не обращается к диску.
+    """
+
+    def __init__(self):
+        self.by_id: Dict[int, Dict[str, Any]] = {}
+        self.by_date: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self.by_status: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        # Ключ (user_id, location, date, time) -> число бронирований с этим ключом
+        self.slot_keys: Dict[Tuple, int] = {}
+        # Отправление (location, date, time) -> занятые места
+        self.seats_taken: Dict[Tuple, int] = {}
+        # ID бронирования -> (отправление, места), которые оно сейчас занимает
+        self._held_seats: Dict[int, Tuple[Tuple, int]] = {}
+        # Индексы по пользователю и для поиска строятся при первом обращении,
+        # чтобы не замедлять запуск, и дальше обновляются вместе с остальными
+        self._by_user: Optional[Dict[Any, Dict[int, Dict[str, Any]]]] = None
+        self._search: Optional[SearchIndex] = None
+
+    @staticmethod
+    def slot_key(booking: Dict[str, Any]) -> Tuple:
+        return (booking.get('user_id'), booking.get('location'), booking.get('date'), booking.get('time'))
+
+    @staticmethod
+    def departure_key(booking: Dict[str, Any]) -> Tuple:
+        return (booking.get('location'), booking.get('date'), booking.get('time'))
+
+    @staticmethod
+    def _bucket_add(buckets: Dict[Any, Dict[int, Dict[str, Any]]], key, booking: Dict[str, Any]) -> None:
+        buckets.setdefault(key, {})[booking['id']] = booking
+
+    @staticmethod
+    def _bucket_remove(buckets: Dict[Any, Dict[int, Dict[str, Any]]], key, booking_id: int) -> None:
+        bucket = buckets.get(key)
+        if bucket is not None:
+            bucket.pop(booking_id, None)
+            if not bucket:
+                del buckets[key]
+
+    def _unlink_status(self, booking_id: int) -> None:
+        # Статус в словаре бронирования мог уже измениться, поэтому ищем по всем
+        # корзинам — статусов всего несколько
+        for status in [st for st, bucket in self.by_status.items() if booking_id in bucket]:
+            self._bucket_remove(self.by_status, status, booking_id)
+
+    def load(self, bookings: List[Dict[str, Any]]) -> None:
+        # То же, что add() для каждого бронирования, но без вызовов методов:
+        # на миллионе записей это основная часть времени холодного старта
+        by_id, by_date, by_status = {}, {}, {}
+        slot_keys, seats_taken, held_seats = {}, {}, {}
+        for booking in bookings:
+            booking_id = booking['id']
+            date = booking.get('date')
+            status = booking.get('status')
+            by_id[booking_id] = booking
+            bucket = by_date.get(date)
+            if bucket is None:
+                bucket = by_date[date] = {}
+            bucket[booking_id] = booking
+            bucket = by_status.get(status)
+            if bucket is None:
+                bucket = by_status[status] = {}
+            bucket[booking_id] = booking
+            location, time = booking.get('location'), booking.get('time')
+            key = (booking.get('user_id'), location, date, time)
+            slot_keys[key] = slot_keys.get(key, 0) + 1
+            if (status if 'status' in booking else 'new') in ACTIVE_STATUSES:
+                try:
+                    people = int(booking.get('people') or 0)
+                except (TypeError, ValueError):
+                    people = 0
+                departure = (location, date, time)
+                held_seats[booking_id] = (departure, people)
+                seats_taken[departure] = seats_taken.get(departure, 0) + people
+        self.by_id, self.by_date, self.by_status = by_id, by_date, by_status
+        self.slot_keys, self.seats_taken, self._held_seats = slot_keys, seats_taken, held_seats
+        self._by_user = None
+        self._search = None
+
+    @property
+    def by_user(self) -> Dict[Any, Dict[int, Dict[str, Any]]]:
+        if self._by_user is None:
+            by_user = {}
+            for booking in self.by_id.values():
+                self._bucket_add(by_user, booking.get('user_id'), booking)
+            self._by_user = by_user
+        return self._by_user
+
+    @property
+    def search(self) -> SearchIndex:
+        if self._search is None:
+            search = SearchIndex(self.by_date, self.by_status, self.by_user)
+            search.load(self.by_id.values())
+            self._search = search
+        return self._search
+
+    def _hold_seats(self, booking: Dict[str, Any]) -> None:
+        if booking.get('status', 'new') not in ACTIVE_STATUSES:
+            return
         try:
-            with open(BOOKINGS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
-    return []
+            people = int(booking.get('people') or 0)
+        except (TypeError, ValueError):
+            people = 0
+        departure = self.departure_key(booking)
+        self._held_seats[booking['id']] = (departure, people)
+        self.seats_taken[departure] = self.seats_taken.get(departure, 0) + people
+
+    def _release_seats(self, booking_id: int) -> None:
+        held = self._held_seats.pop(booking_id, None)
+        if held is None:
+            return
+        departure, people = held
+        left = self.seats_taken.get(departure, 0) - people
+        if left > 0:
+            self.seats_taken[departure] = left
+        else:
+            self.seats_taken.pop(departure, None)
+
+    def refresh_status(self, booking: Dict[str, Any]) -> None:
+        """Пересчитывает занятые места после смены статуса бронирования"""
+        self._release_seats(booking['id'])
+        self._hold_seats(booking)
+        self._unlink_status(booking['id'])
+        self._bucket_add(self.by_status, booking.get('status'), booking)
+
+    def add(self, booking: Dict[str, Any]) -> None:
+        self.by_id[booking['id']] = booking
+        self._bucket_add(self.by_date, booking.get('date'), booking)
+        self._bucket_add(self.by_status, booking.get('status'), booking)
+        if self._by_user is not None:
+            self._bucket_add(self._by_user, booking.get('user_id'), booking)
+        key = self.slot_key(booking)
+        self.slot_keys[key] = self.slot_keys.get(key, 0) + 1
+        self._hold_seats(booking)
+        if self._search is not None:
+            self._search.add(booking)
+
+    def remove(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        booking = self.by_id.pop(booking_id, None)
+        if booking is None:
+            return None
+        self._bucket_remove(self.by_date, booking.get('date'), booking_id)
+        self._unlink_status(booking_id)
+        if self._by_user is not None:
+            self._bucket_remove(self._by_user, booking.get('user_id'), booking_id)
+        key = self.slot_key(booking)
+        if self.slot_keys.get(key, 0) > 1:
+            self.slot_keys[key] -= 1
+        else:
+            self.slot_keys.pop(key, None)
+        self._release_seats(booking_id)
+        if self._search is not None:
+            self._search.remove(booking)
+        return booking
+
+
+_index: Optional[BookingIndex] = None
+# Положение в журнале изменений общего хранилища, до которого применён индекс
+_cursor = None
+
+def _load_from_storage(index: BookingIndex, freeze: bool = False):
+    """Заполняет индекс из хранилища. Возвращает курсор изменений."""
+    # Миллионы новых объектов запускают сборщик мусора раз за разом, хотя циклов
+    # среди них нет
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        bookings, cursor = get_storage().snapshot()
+        index.load(bookings)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if freeze:
+        # Только при первой загрузке: freeze() переносит в постоянное поколение все
+        # живые объекты процесса, и их циклы сборщик больше никогда не соберёт
+        gc.freeze()
+    return cursor
+
+def _sync_index(index: BookingIndex) -> None:
+    """Применяет к индексу изменения, сделанные другими процессами"""
+    global _cursor
+    changes = get_storage().changes_since(_cursor)
+    if changes is None:
+        return
+    _cursor, changed = changes
+    if changed is None:
+        _cursor = _load_from_storage(index)
+        return
+    for booking_id, booking in changed.items():
+        index.remove(booking_id)
+        if booking is not None:
+            index.add(booking)
+
+def _get_index() -> BookingIndex:
+    """Возвращает индекс, загружая его из хранилища при первом обращении.
+
+    Для общего хранилища (несколько процессов) перед каждым обращением
+    подтягиваются чужие изменения.
+    """
+    global _index, _cursor
+    if _index is None:
+        index = BookingIndex()
+        _cursor = _load_from_storage(index, freeze=True)
+        _index = index
+    elif get_storage().shared:
+        _sync_index(_index)
+    return _index
+
+def load_index() -> None:
+    """Загружает индекс бронирований в память, если он ещё не загружен"""
+    _get_index()
 
+@metrics.timed("bookings.load_bookings")
+def load_bookings() -> List[Dict[str, Any]]:
+    """Загружает список бронирований из хранилища"""
+    return get_storage().all()
+
+@metrics.timed("bookings.save_bookings")
 def save_bookings(bookings: List[Dict[str, Any]]) -> None:
-    """Сохраняет список бронирований в файл"""
-    with open(BOOKINGS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(bookings, f, ensure_ascii=False, indent=2)
+    """Сохраняет список бронирований в хранилище"""
+    global _cursor
+    storage = get_storage()
+    storage.replace_all(bookings)
+    if storage.shared:
+        _cursor = _load_from_storage(_get_index())
+    else:
+        _get_index().load(bookings)
 
+@metrics.timed("bookings.add_booking")
 def add_booking(booking_data: Dict[str, Any]) -> Dict[str, Any]:
     """Добавляет новое бронирование"""
-    bookings = load_bookings()
-    
-    # Добавляем ID и timestamp
-    booking_id = len(bookings) + 1
-    booking_data['id'] = booking_id
+    index = _get_index()
+    saved = get_storage().add(_new_booking(booking_data))
+    index.add(saved)
+    return saved
+
+def _new_booking(booking_data: Dict[str, Any]) -> Dict[str, Any]:
+    # ID присваивает хранилище
     booking_data['timestamp'] = datetime.now().isoformat()
     booking_data['status'] = 'new'
-    
-    bookings.append(booking_data)
-    save_bookings(bookings)
-    
     return booking_data
 
+@metrics.timed("bookings.add_booking_if_new")
+def add_booking_if_new(booking_data: Dict[str, Any], capacity: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Добавляет бронирование, если у пользователя ещё нет брони на этот слот. Иначе возвращает None.
+
+    Если передана вместимость отправления и мест не хватает, выбрасывает SlotFullError.
+    """
+    storage = get_storage()
+    if storage.shared:
+        # Другие процессы могли добавить бронирования после синхронизации индекса,
+        # поэтому проверка и вставка выполняются одной транзакцией хранилища
+        index = _get_index()
+        saved = storage.add_if_new(_new_booking(booking_data), capacity, ACTIVE_STATUSES)
+        if saved is not None:
+            index.add(saved)
+        return saved
+    if booking_exists(booking_data['user_id'], booking_data['location'], booking_data['date'], booking_data['time']):
+        return None
+    if capacity is not None:
+        taken = get_seats_taken(booking_data['location'], booking_data['date'], booking_data['time'])
+        if taken + int(booking_data.get('people') or 0) > capacity:
+            raise SlotFullError(f"Свободных мест: {max(capacity - taken, 0)}")
+    return add_booking(booking_data)
+
+@metrics.timed("bookings.get_booking_by_id")
+def get_booking_by_id(booking_id: int) -> Optional[Dict[str, Any]]:
+    """Получает бронирование по ID"""
+    return _get_index().by_id.get(booking_id)
+
+@metrics.timed("bookings.get_bookings_by_date")
 def get_bookings_by_date(date: str) -> List[Dict[str, Any]]:
-    """Получает бронирования по дате"""
-    bookings = load_bookings()
-    return [b for b in bookings if b.get('date') == date]
+    """Получает бронирования по дате (для прошедших месяцев — из архива)"""
+    bucket = _get_index().by_date.get(date)
+    if bucket is None:
+        return get_storage().archived_by_date(date)
+    return list(bucket.values())
 
+@metrics.timed("bookings.get_all_bookings")
 def get_all_bookings() -> List[Dict[str, Any]]:
     """Получает все бронирования"""
-    return load_bookings()
+    return list(_get_index().by_id.values())
+
+@metrics.timed("bookings.query_bookings")
+def query_bookings(date: Optional[str] = None, status: Optional[str] = None,
+                   offset: int = 0, limit: int = 10) -> Tuple[int, List[Dict[str, Any]]]:
+    """Возвращает (число найденных, страница) бронирований с фильтром по дате и статусу.
+
+    Фильтры обслуживаются индексом, в список попадают только записи страницы.
+    """
+    index = _get_index()
+    if date is not None and date not in index.by_date:
+        # Даты нет среди оперативных бронирований — смотрим архив
+        matches = [b for b in get_storage().archived_by_date(date) if status is None or b.get('status') == status]
+        return len(matches), matches[offset:offset + limit]
+    if date is not None and status is not None:
+        # Бронирований на одну дату немного — фильтруем корзину даты по статусу
+        matches = [b for b in index.by_date.get(date, {}).values() if b.get('status') == status]
+        return len(matches), matches[offset:offset + limit]
+    if date is not None:
+        bucket = index.by_date.get(date, {})
+    elif status is not None:
+        bucket = index.by_status.get(status, {})
+    else:
+        bucket = index.by_id
+    return len(bucket), list(islice(bucket.values(), offset, offset + limit))
+
+@metrics.timed("bookings.find_bookings")
+def find_bookings(user_id=None, username: Optional[str] = None, name: Optional[str] = None,
+                  location: Optional[str] = None, status: Optional[str] = None,
+                  date_from: Optional[str] = None, date_to: Optional[str] = None,
+                  offset: int = 0, limit: int = 10) -> Tuple[int, List[Dict[str, Any]]]:
+    """Поиск по вторичным индексам: (число найденных, страница) по порядку дат тура.
+
+    Условия объединяются через «и»; name — начало слова в имени, username — без учёта регистра.
+    Архив прошедших месяцев не просматривается.
+    """
+    matches = _get_index().search.find(user_id, username, name, location, status, date_from, date_to)
+    return len(matches), matches[offset:offset + limit]
+
+def departure_at(booking: Dict[str, Any]) -> Optional[datetime]:
+    """Дата и время отправления; None, если они некорректны"""
+    try:
+        return datetime.strptime(f"{booking['date']} {booking['time']}", "%d.%m.%Y %H:%M")
+    except (KeyError, TypeError, ValueError):
+        return None
+
+@metrics.timed("bookings.get_user_bookings")
+def get_user_bookings(user_id, upcoming_only: bool = False) -> List[Dict[str, Any]]:
+    """Бронирования пользователя по порядку отправления (индекс по user_id, без перебора всех).
+
+    upcoming_only — только активные бронирования на туры, которые ещё не начались.
+    """
+    bookings = list(_get_index().by_user.get(user_id, {}).values())
+    if upcoming_only:
+        now = datetime.now()
+        bookings = [
+            b for b in bookings
+            if b.get('status') in ACTIVE_STATUSES and (departure_at(b) or now) > now
+        ]
+    bookings.sort(key=lambda b: (departure_at(b) or datetime.max, b['id']))
+    return bookings
+
+@metrics.timed("bookings.cancel_user_booking")
+def cancel_user_booking(booking_id: int, user_id) -> Optional[Dict[str, Any]]:
+    """Отмена бронирования самим клиентом. Возвращает бронирование, если оно отменено.
 
+    Отменить можно только своё активное бронирование на тур, который ещё не начался.
+    """
+    booking = _get_index().by_id.get(booking_id)
+    if booking is None or booking.get('user_id') != user_id or booking.get('status') not in ACTIVE_STATUSES:
+        return None
+    departure = departure_at(booking)
+    if departure is not None and departure <= datetime.now():
+        return None
+    if not update_booking_status(booking_id, 'cancelled'):
+        return None
+    return booking
+
+def _parse_date(date: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(date, "%d.%m.%Y")
+    except (TypeError, ValueError):
+        return None
+
+def iter_bookings(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                  status: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Перебирает бронирования по порядку дат тура, не собирая их в список.
+
+    Границы диапазона (формат ДД.ММ.ГГГГ) включительны; архив прошедших месяцев
+    читается по одному месяцу. Пока генератор не исчерпан, изменять бронирования
+    в другом потоке нельзя.
+    """
+    index = _get_index()
+    start = _parse_date(date_from) if date_from else None
+    end = _parse_date(date_to) if date_to else None
+    # Архив содержит только месяцы раньше оперативных разделов
+    archived = []
+    current_month = None
+    for booking in get_storage().iter_archived(start, end):
+        parsed = _parse_date(booking.get('date'))
+        if parsed is None or (start is not None and parsed < start) or (end is not None and parsed > end):
+            continue
+        if status is not None and booking.get('status') != status:
+            continue
+        if (parsed.year, parsed.month) != current_month:
+            archived.sort(key=lambda b: _parse_date(b['date']))
+            yield from archived
+            archived, current_month = [], (parsed.year, parsed.month)
+        archived.append(booking)
+    archived.sort(key=lambda b: _parse_date(b['date']))
+    yield from archived
+    dates = []
+    for date in index.by_date:
+        parsed = _parse_date(date)
+        if parsed is None:
+            continue
+        if (start is None or parsed >= start) and (end is None or parsed <= end):
+            dates.append((parsed, date))
+    dates.sort()
+    for _, date in dates:
+        for booking in index.by_date[date].values():
+            if status is None or booking.get('status') == status:
+                yield booking
+
+@metrics.timed("bookings.update_booking_status")
 def update_booking_status(booking_id: int, status: str) -> bool:
     """Обновляет статус бронирования"""
-    bookings = load_bookings()
-    for booking in bookings:
-        if booking.get('id') == booking_id:
+    index = _get_index()
+    if not get_storage().update_status(booking_id, status):
+        return False
+    booking = index.by_id.get(booking_id)
+    if booking is not None:
+        booking['status'] = status
+        index.refresh_status(booking)
+    return True
+
+@metrics.timed("bookings.update_booking_status_many")
+def update_booking_status_many(booking_ids: List[int], status: str,
+                               capacity: Optional[Callable[[str], int]] = None
+                               ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Меняет статус нескольких бронирований одной транзакцией хранилища.
+
+    Бронирования, у которых статус уже такой, и архивные не меняются. Если передана
+    вместимость отправлений (локация -> мест), отменённые бронирования не возвращаются
+    в активные сверх неё. Возвращает изменённые бронирования и не поместившиеся.
+    """
+    index = _get_index()
+    ids = [
+        booking_id for booking_id in dict.fromkeys(booking_ids)
+        if booking_id in index.by_id and index.by_id[booking_id].get('status') != status
+    ]
+    if not ids:
+        return [], []
+    storage = get_storage()
+    full_ids: List[int] = []
+    if capacity is None or status not in ACTIVE_STATUSES:
+        updated = storage.update_status_many(ids, status)
+    elif storage.shared:
+        # Другие процессы могли занять места после синхронизации индекса
+        updated, full_ids = storage.update_status_many_if_fits(ids, status, capacity, ACTIVE_STATUSES)
+    else:
+        fitting, extra = [], {}
+        for booking_id in ids:
+            booking = index.by_id[booking_id]
+            if booking.get('status') not in ACTIVE_STATUSES:
+                departure = (booking.get('location'), booking.get('date'), booking.get('time'))
+                people = int(booking.get('people') or 0)
+                taken = index.seats_taken.get(departure, 0) + extra.get(departure, 0)
+                if taken + people > capacity(departure[0]):
+                    full_ids.append(booking_id)
+                    continue
+                extra[departure] = extra.get(departure, 0) + people
+            fitting.append(booking_id)
+        updated = storage.update_status_many(fitting, status) if fitting else []
+    changed = []
+    for booking_id in updated:
+        booking = index.by_id.get(booking_id)
+        if booking is not None:
             booking['status'] = status
-            save_bookings(bookings)
-            return True
-    return False 
+            index.refresh_status(booking)
+            changed.append(booking)
+    return changed, [index.by_id[booking_id] for booking_id in full_ids if booking_id in index.by_id]
+
+@metrics.timed("bookings.get_departure_bookings")
+def get_departure_bookings(location: str, date: str, time: str) -> List[Dict[str, Any]]:
+    """Активные бронирования на отправление (по индексу даты)"""
+    return [
+        b for b in _get_index().by_date.get(date, {}).values()
+        if b.get('location') == location and b.get('time') == time and b.get('status') in ACTIVE_STATUSES
+    ]
 
+@metrics.timed("bookings.update_departure_status")
+def update_departure_status(location: str, date: str, time: str, status: str) -> List[Dict[str, Any]]:
+    """Меняет статус всех активных бронирований отправления одной транзакцией. Возвращает изменённые."""
+    # Активные бронирования уже держат места, проверять вместимость не нужно
+    return update_booking_status_many([b['id'] for b in get_departure_bookings(location, date, time)], status)[0]
+
+@metrics.timed("bookings.booking_exists")
 def booking_exists(user_id, location, date, time):
-    bookings = get_all_bookings()
-    for booking in bookings:
-        if (
-            booking['user_id'] == user_id and
-            booking['location'] == location and
-            booking['date'] == date and
-            booking['time'] == time
-        ):
-            return True
-    return False 
+    return (user_id, location, date, time) in _get_index().slot_keys
+
+@metrics.timed("bookings.get_seats_taken")
+def get_seats_taken(location: str, date: str, time: str) -> int:
+    """Возвращает число занятых мест на отправление (без отменённых бронирований)"""
+    return _get_index().seats_taken.get((location, date, time), 0)
 
+@metrics.timed("bookings.delete_all_bookings")
 def delete_all_bookings() -> None:
     """Удаляет все бронирования (очищает файл)"""
     save_bookings([])
 
 
+@metrics.timed("bookings.delete_booking_by_id")
 def delete_booking_by_id(booking_id: int) -> bool:
     """Удаляет бронирование по ID. Возвращает True, если удалено, иначе False."""
-    bookings = load_bookings()
-    new_bookings = [b for b in bookings if b.get('id') != booking_id]
-    if len(new_bookings) == len(bookings):
-        return False  # Ничего не удалено
-    save_bookings(new_bookings)
-    return True 
\ No newline at end of file
+    index = _get_index()
+    if not get_storage().delete(booking_id):
+        return False
+    index.remove(booking_id)
+    return True
+
+@metrics.timed("bookings.archive_past_tours")
+def archive_past_tours(today: Optional[datetime] = None) -> int:
+    """Переносит в архив бронирования прошедших месяцев. Возвращает их число."""
+    today = today or datetime.now()
+    index = _get_index()
+    archived = get_storage().archive(today.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+    for booking_id in archived:
+        index.remove(booking_id)
+    return len(archived)
+
+@metrics.timed("bookings.flush")
+def flush() -> None:
+    """Надёжно записывает на диск накопленные изменения (групповая фиксация)"""
+    get_storage().flush()
+
+def set_group_commit(enabled: bool) -> None:
+    """Включает накопление изменений до flush(); при выключении сразу сбрасывает их на диск"""
+    storage = get_storage()
+    storage.autoflush = not enabled
+    if not enabled:
+        storage.flush()
+
+def close_storage() -> None:
+    """Закрывает хранилище (файл журнала, соединение с базой), если оно было открыто"""
+    if _storage is None:
+        return
+    _storage.flush()
+    _storage.close()
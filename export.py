@@ -0,0 +1,56 @@
+import csv
+from typing import Any, Dict, Iterable, List, Sequence
+
+try:
+    from openpyxl import Workbook  # type: ignore
+except ImportError:  # XLSX-выгрузка необязательна
+    Workbook = None
+
+EXPORT_COLUMNS = ('id', 'date', 'time', 'location', 'people', 'status',
+                  'user_id', 'username', 'first_name', 'chat_id', 'timestamp')
+# С этих символов Excel начинает формулу
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def xlsx_available() -> bool:
+    return Workbook is not None
+
+
+def _cell(value: Any) -> Any:
+    """Текст вроде имени «=HYPERLINK(...)» Excel выполнил бы как формулу — экранируем апострофом"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def rows(bookings: Iterable[Dict[str, Any]]) -> List[List[Any]]:
+    """Строки выгрузки (значения столбцов EXPORT_COLUMNS) для бронирований"""
+    return [[_cell(booking.get(column)) for column in EXPORT_COLUMNS] for booking in bookings]
+
+
+def write_csv(rows: Iterable[Sequence[Any]], path: str) -> int:
+    """Построчно записывает строки выгрузки в CSV. Возвращает число строк."""
+    count = 0
+    # utf-8-sig и точка с запятой — чтобы файл сразу открывался в русском Excel
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_xlsx(rows: Iterable[Sequence[Any]], path: str) -> int:
+    """Построчно записывает строки выгрузки в XLSX (режим write_only). Возвращает число строк."""
+    if Workbook is None:
+        raise RuntimeError("Для выгрузки в XLSX установите openpyxl")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Бронирования")
+    sheet.append(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
@@ -0,0 +1,352 @@
+import json
+import marshal
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import List, Dict, Any, Optional
+from storage import BookingStorage, SqliteStorage, write_atomic
+from metrics import metrics
+
+# Двоичный снимок: сигнатура с номером версии формата, CRC32 и длина данных, затем три
+# блока, каждый с длиной (<Q): JSON-заголовок, таблица строк в UTF-8 через \0 и колонки
+# подряд — массивы little-endian: int64 для целых колонок, int32 номеров строк для
+# остальных (-1 — None). Значения, которые в колонку не ложатся, и поля вне колонок
+# лежат в заголовке по номеру строки. Формат не зависит от версии интерпретатора,
+# в отличие от marshal, которым писалась версия 1.
+SNAPSHOT_MAGIC = b'JTSNAP2\n'
+SNAPSHOT_MAGIC_V1 = b'JTSNAP1\n'
+SNAPSHOT_HEADER = struct.Struct('<IQ')
+SNAPSHOT_LENGTH = struct.Struct('<Q')
+SNAPSHOT_COLUMNS = SqliteStorage.COLUMNS
+SNAPSHOT_INT_COLUMNS = ('id', 'user_id', 'chat_id')
+SNAPSHOT_FORMATS = ('binary', 'json')
+
+
+class SnapshotError(Exception):
+    """Двоичный снимок повреждён или не читается"""
+
+
+class JournalError(Exception):
+    """Запись в середине журнала повреждена"""
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def encode_snapshot(bookings) -> bytes:
+    columns = SNAPSHOT_COLUMNS
+    # Одинаковые строки (локации, даты, статусы) записываются один раз
+    strings: Dict[str, int] = {}
+    data = [array('q' if c in SNAPSHOT_INT_COLUMNS else 'i') for c in columns]
+    kinds = [c in SNAPSHOT_INT_COLUMNS for c in columns]
+    special: Dict[int, Dict[str, Any]] = {}
+    for number, booking in enumerate(bookings):
+        row_special = None
+        for values, is_int, column in zip(data, kinds, columns):
+            value = booking.get(column)
+            if is_int:
+                if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+                    values.append(value)
+                    continue
+                values.append(0)
+            elif value is None:
+                values.append(-1)
+                if column in booking:
+                    continue
+            elif type(value) is str and '\0' not in value:
+                values.append(strings.setdefault(value, len(strings)))
+                continue
+            else:
+                values.append(-1)
+            if row_special is None:
+                row_special = special[number] = {'set': {}, 'missing': []}
+            if column in booking:
+                row_special['set'][column] = value
+            else:
+                row_special['missing'].append(column)
+        missing = row_special['missing'] if row_special else ()
+        if len(booking) > len(columns) - len(missing):
+            # Поля вне колонок
+            if row_special is None:
+                row_special = special[number] = {'set': {}, 'missing': []}
+            row_special['set'].update((k, v) for k, v in booking.items() if k not in columns)
+    header = json.dumps({
+        'columns': columns,
+        'int_columns': [c for c in columns if c in SNAPSHOT_INT_COLUMNS],
+        'rows': len(data[0]),
+        'special': special,
+    }, ensure_ascii=False).encode('utf-8')
+    blocks = [header, '\0'.join(strings).encode('utf-8')]
+    blocks += [_little_endian(values).tobytes() for values in data]
+    payload = b''.join(SNAPSHOT_LENGTH.pack(len(block)) + block for block in blocks)
+    return SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(zlib.crc32(payload), len(payload)) + payload
+
+
+def _read_payload(data: bytes, magic: bytes) -> memoryview:
+    offset = len(magic) + SNAPSHOT_HEADER.size
+    crc, length = SNAPSHOT_HEADER.unpack_from(data, len(magic))
+    payload = memoryview(data)[offset:]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise SnapshotError("контрольная сумма снимка не совпадает")
+    return payload
+
+
+def _decode_v1(payload: memoryview) -> Dict[int, Dict[str, Any]]:
+    """Снимок версии 1 (marshal): читается один раз, следующее уплотнение пишет версию 2"""
+    try:
+        columns, rows = marshal.loads(payload)
+    except (EOFError, ValueError, TypeError) as e:
+        raise SnapshotError(f"снимок версии 1 не читается этой версией Python: {e}")
+    id_position = columns.index('id')
+    bookings = {}
+    for row in rows:
+        booking = dict(zip(columns, row))
+        tail = row[-1]
+        if tail is not None:
+            extra, missing = tail
+            booking.update(extra)
+            for key in missing:
+                del booking[key]
+        bookings[row[id_position]] = booking
+    return bookings
+
+
+def decode_snapshot(data: bytes) -> Dict[int, Dict[str, Any]]:
+    if data.startswith(SNAPSHOT_MAGIC_V1):
+        return _decode_v1(_read_payload(data, SNAPSHOT_MAGIC_V1))
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise SnapshotError("неизвестный формат снимка")
+    payload = _read_payload(data, SNAPSHOT_MAGIC)
+    try:
+        blocks = []
+        offset = 0
+        while offset < len(payload):
+            (length,) = SNAPSHOT_LENGTH.unpack_from(payload, offset)
+            offset += SNAPSHOT_LENGTH.size
+            blocks.append(payload[offset:offset + length])
+            offset += length
+        header = json.loads(str(blocks[0], 'utf-8'))
+        columns, int_columns, rows = header['columns'], set(header['int_columns']), header['rows']
+        strings: List[Optional[str]] = str(blocks[1], 'utf-8').split('\0') if len(blocks[1]) else []
+        # Номер -1 (None) указывает на последний элемент
+        strings.append(None)
+        column_values = []
+        for column, block in zip(columns, blocks[2:]):
+            values = array('q' if column in int_columns else 'i')
+            values.frombytes(block)
+            _little_endian(values)
+            if len(values) != rows:
+                raise ValueError(f"в колонке {column} {len(values)} значений вместо {rows}")
+            column_values.append(values.tolist() if column in int_columns else [strings[i] for i in values])
+        if len(column_values) != len(columns):
+            raise ValueError("в снимке не хватает колонок")
+    except (ValueError, KeyError, TypeError, IndexError, struct.error) as e:
+        raise SnapshotError(str(e))
+    bookings = [dict(zip(columns, row)) for row in zip(*column_values)]
+    for number, changes in header['special'].items():
+        booking = bookings[int(number)]
+        booking.update(changes['set'])
+        for key in changes['missing']:
+            del booking[key]
+    return {booking['id']: booking for booking in bookings}
+
+
+class BookingJournal(BookingStorage):
+    """Журнал бронирований: снимок (JSON-массив) + хвост изменений в формате JSON Lines.
+
+    Каждая мутация дописывается в журнал одной строкой, поэтому запись стоит
+    O(1), а не O(количество бронирований). Состояние в памяти восстанавливается
+    при старте из снимка и журнала, а периодическое уплотнение переносит журнал
+    в новый снимок.
+
+    Если задан binary_snapshot_file, снимок пишется в компактном двоичном формате
+    с контрольной суммой, а JSON-снимок читается только при первом запуске.
+    """
+
+    def __init__(self, snapshot_file: str, journal_file: str, compact_every: int = 1000,
+                 binary_snapshot_file: Optional[str] = None):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.binary_snapshot_file = binary_snapshot_file
+        self._bookings: Optional[Dict[int, Dict[str, Any]]] = None
+        self._journal = None
+        self._records_since_compact = 0
+        self._unsynced = False
+        self._last_id = 0
+
+    # --- Загрузка состояния ---
+
+    def _load_snapshot(self) -> Dict[int, Dict[str, Any]]:
+        if self.binary_snapshot_file and os.path.exists(self.binary_snapshot_file):
+            with open(self.binary_snapshot_file, 'rb') as f:
+                data = f.read()
+            metrics.inc('storage.bytes_read', len(data))
+            try:
+                return decode_snapshot(data)
+            except SnapshotError as e:
+                # Журнал уже уплотнён в этот снимок: старый JSON-снимок без него неполон
+                raise SnapshotError(f"{self.binary_snapshot_file}: {e}") from e
+        if not os.path.exists(self.snapshot_file):
+            return {}
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                metrics.inc('storage.bytes_read', os.fstat(f.fileno()).st_size)
+                data = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return {}
+        return {b['id']: b for b in data if 'id' in b}
+
+    def _replay(self, bookings: Dict[int, Dict[str, Any]]) -> int:
+        """Применяет записи журнала к состоянию. Возвращает число записей.
+
+        Недописанная последняя строка после сбоя отрезается от файла, иначе следующая
+        запись продолжила бы её и тоже не читалась. Повреждённая полная строка — ошибка.
+        """
+        if not os.path.exists(self.journal_file):
+            return 0
+        with open(self.journal_file, 'rb') as f:
+            data = f.read()
+        metrics.inc('storage.bytes_read', len(data))
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+        count = 0
+        for number, line in enumerate(data[:end].splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise JournalError(f"{self.journal_file}, строка {number}: {e}") from e
+            self._apply(bookings, record)
+            count += 1
+        return count
+
+    @staticmethod
+    def _apply(bookings: Dict[int, Dict[str, Any]], record: Dict[str, Any]) -> None:
+        # Все операции идемпотентны: повторное применение журнала поверх
+        # снимка, в который он уже уплотнён, даёт то же состояние.
+        op = record.get('op')
+        if op == 'add':
+            booking = record['booking']
+            bookings[booking['id']] = booking
+        elif op == 'status':
+            booking = bookings.get(record['id'])
+            if booking is not None:
+                booking['status'] = record['status']
+        elif op == 'status_many':
+            for booking_id in record['ids']:
+                booking = bookings.get(booking_id)
+                if booking is not None:
+                    booking['status'] = record['status']
+        elif op == 'delete':
+            bookings.pop(record['id'], None)
+        elif op == 'clear':
+            bookings.clear()
+
+    def _ensure_loaded(self) -> Dict[int, Dict[str, Any]]:
+        if self._bookings is None:
+            bookings = self._load_snapshot()
+            self._records_since_compact = self._replay(bookings)
+            self._bookings = bookings
+            self._last_id = max(self._last_id, max(bookings, default=0))
+            if self._records_since_compact >= self.compact_every:
+                self.compact()
+        return self._bookings
+
+    # --- Запись ---
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'ab')
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        self._journal.write(line)
+        metrics.inc('storage.bytes_written', len(line))
+        self._records_since_compact += 1
+        self._unsynced = True
+        if self._records_since_compact >= self.compact_every:
+            self.compact()
+        elif self.autoflush:
+            self.flush()
+
+    def flush(self) -> None:
+        """Одним fsync делает надёжными все дописанные с прошлого раза записи"""
+        if self._unsynced:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            metrics.inc('storage.fsyncs')
+            self._unsynced = False
+
+    def compact(self) -> None:
+        """Записывает текущее состояние в снимок и очищает журнал"""
+        bookings = self._ensure_loaded()
+        if self.binary_snapshot_file:
+            write_atomic(self.binary_snapshot_file, encode_snapshot(bookings.values()))
+        else:
+            data = json.dumps(list(bookings.values()), ensure_ascii=False, indent=2).encode('utf-8')
+            write_atomic(self.snapshot_file, data)
+        # Журнал очищаем только после того, как снимок надёжно записан
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_file, 'wb')
+        self._records_since_compact = 0
+        self._unsynced = False
+
+    def close(self) -> None:
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # --- Операции ---
+
+    def all(self) -> List[Dict[str, Any]]:
+        return list(self._ensure_loaded().values())
+
+    def get(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        return self._ensure_loaded().get(booking_id)
+
+    def add(self, booking: Dict[str, Any]) -> Dict[str, Any]:
+        bookings = self._ensure_loaded()
+        self._last_id += 1
+        booking['id'] = self._last_id
+        bookings[booking['id']] = booking
+        self._append({'op': 'add', 'booking': booking})
+        return booking
+
+    def update_status(self, booking_id: int, status: str) -> bool:
+        booking = self._ensure_loaded().get(booking_id)
+        if booking is None:
+            return False
+        booking['status'] = status
+        self._append({'op': 'status', 'id': booking_id, 'status': status})
+        return True
+
+    def update_status_many(self, booking_ids: List[int], status: str) -> List[int]:
+        bookings = self._ensure_loaded()
+        updated = [booking_id for booking_id in booking_ids if booking_id in bookings]
+        if updated:
+            for booking_id in updated:
+                bookings[booking_id]['status'] = status
+            # Одна запись журнала: после сбоя изменения применяются целиком или не применяются
+            self._append({'op': 'status_many', 'ids': updated, 'status': status})
+        return updated
+
+    def delete(self, booking_id: int) -> bool:
+        if self._ensure_loaded().pop(booking_id, None) is None:
+            return False
+        self._append({'op': 'delete', 'id': booking_id})
+        return True
+
+    def replace_all(self, bookings: List[Dict[str, Any]]) -> None:
+        self._bookings = {b['id']: b for b in bookings if 'id' in b}
+        self._last_id = max(self._last_id, max(self._bookings, default=0))
+        self.compact()
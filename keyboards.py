@@ -0,0 +1,133 @@
+from datetime import date, datetime, timedelta, time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from bookings import get_seats_taken
+from schedule import PARSED_TIMES, departure_capacity
+
+RU_WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+CALENDAR_DAYS = 14
+
+MAX_PEOPLE = 6
+
+# Кэш клавиатур: ключ -> (клавиатура, момент, после которого она устаревает).
+# В ключ входит показываемая доступность мест, поэтому новая бронь сама
+# приводит к построению новой клавиатуры.
+_cache: Dict[Tuple, Tuple[InlineKeyboardMarkup, datetime]] = {}
+
+
+def _cancel_row() -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
+
+
+def _times_left_today(location: Optional[str], now: datetime) -> List[Tuple[str, time]]:
+    return [(t, parsed) for t, parsed in PARSED_TIMES.get(location, []) if parsed > now.time()]
+
+
+@lru_cache(maxsize=64)
+def _parse_date(date_str: str) -> date:
+    return datetime.strptime(date_str, "%d.%m.%Y").date()
+
+
+def seats_left(location: str, date_str: str, t: str) -> int:
+    """Свободные места на отправление"""
+    return max(departure_capacity(location) - get_seats_taken(location, date_str, t), 0)
+
+
+def _available_times(location: Optional[str], day: date, date_str: str, now: datetime) -> List[Tuple[str, int]]:
+    """Отправления на дату, которые ещё не прошли и где есть места: [(время, свободно), ...]"""
+    times = _times_left_today(location, now) if day == now.date() else PARSED_TIMES.get(location, [])
+    available = []
+    for t, _ in times:
+        left = seats_left(location, date_str, t)
+        if left > 0:
+            available.append((t, left))
+    return available
+
+
+def _expires_at(location: Optional[str], now: datetime) -> datetime:
+    """Момент, когда клавиатура устаревает: ближайшее прошедшее сегодня отправление или полночь"""
+    midnight = datetime.combine(now.date() + timedelta(days=1), time())
+    times_left = _times_left_today(location, now)
+    if times_left:
+        # Отправление перестаёт быть доступным, как только наступает его время
+        return min(midnight, datetime.combine(now.date(), times_left[0][1]))
+    return midnight
+
+
+def _cached(key: Tuple, now: datetime):
+    entry = _cache.get(key)
+    if entry is not None and now < entry[1]:
+        return entry[0]
+    return None
+
+
+def _store(key: Tuple, markup: InlineKeyboardMarkup, expires_at: datetime, now: datetime) -> InlineKeyboardMarkup:
+    if len(_cache) > 256:
+        for stale_key in [k for k, (_, expires) in _cache.items() if expires <= now]:
+            del _cache[stale_key]
+    _cache[key] = (markup, expires_at)
+    return markup
+
+
+def calendar_keyboard(location: Optional[str]) -> InlineKeyboardMarkup:
+    """Клавиатура с датами на ближайшие 14 дней; скрывает даты, где все отправления прошли или заняты"""
+    now = datetime.now()
+    shown_days = []
+    for i in range(CALENDAR_DAYS):
+        day = now.date() + timedelta(days=i)
+        date_str = day.strftime("%d.%m.%Y")
+        if location in PARSED_TIMES and not _available_times(location, day, date_str, now):
+            continue
+        shown_days.append((i, day, date_str))
+    key = ('calendar', location, now.date(), tuple(i for i, _, _ in shown_days))
+    markup = _cached(key, now)
+    if markup is not None:
+        return markup
+
+    keyboard = []
+    for i, day, date_str in shown_days:
+        if i == 0:
+            button_text = f"Сегодня ({date_str})"
+        elif i == 1:
+            button_text = f"Завтра ({date_str})"
+        else:
+            button_text = f"{RU_WEEKDAYS[day.weekday()]} {date_str}"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"date_{date_str}")])
+    keyboard.append(_cancel_row())
+    return _store(key, InlineKeyboardMarkup(keyboard), _expires_at(location, now), now)
+
+
+def time_keyboard(location: Optional[str], date_str: str) -> InlineKeyboardMarkup:
+    """Клавиатура со временем отправлений и свободными местами; прошедшие и заполненные скрыты"""
+    now = datetime.now()
+    available_times = _available_times(location, _parse_date(date_str), date_str, now)
+    key = ('time', location, date_str, tuple(available_times))
+    markup = _cached(key, now)
+    if markup is not None:
+        return markup
+
+    keyboard = [
+        [InlineKeyboardButton(f"{t} · свободно мест: {left}", callback_data=f"time_{t}")]
+        for t, left in available_times
+    ]
+    keyboard.append(_cancel_row())
+    return _store(key, InlineKeyboardMarkup(keyboard), _expires_at(location, now), now)
+
+
+def _build_people_keyboard(max_people: int) -> InlineKeyboardMarkup:
+    keyboard = []
+    # Создаем кнопки от 1 до max_people пассажиров
+    for i in range(1, max_people + 1):
+        keyboard.append([InlineKeyboardButton(f"{i} {'человек' if i == 1 else 'человека' if i < 5 else 'человек'}", callback_data=f"people_{i}")])
+    keyboard.append(_cancel_row())
+    return InlineKeyboardMarkup(keyboard)
+
+
+# Клавиатуры выбора количества пассажиров не меняются — строим их один раз
+PEOPLE_KEYBOARDS = {n: _build_people_keyboard(n) for n in range(1, MAX_PEOPLE + 1)}
+
+
+def people_keyboard(max_people: int = MAX_PEOPLE) -> InlineKeyboardMarkup:
+    """Клавиатура для выбора количества пассажиров (не больше свободных мест)"""
+    return PEOPLE_KEYBOARDS[max(1, min(max_people, MAX_PEOPLE))]
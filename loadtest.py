@@ -0,0 +1,261 @@
+"""Нагрузочный тест диалога бронирования без обращения к Telegram.
+
+Собирает настоящий Application из main.py, подменяет HTTP-клиент бота заглушкой
+и прогоняет синтетических пользователей через весь сценарий:
+"Забронировать экскурсию" → локация → date_ → time_ → people_ → confirm_yes.
+
+Пример:
+    python3 loadtest.py --users 5000 --concurrency 200 --storage sqlite --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import metrics  # noqa: E402
+from storage import STORAGE_MODES  # noqa: E402
+
+STEPS = ('start', 'location', 'date', 'time', 'people', 'confirm')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диалога бронирования")
+    parser.add_argument('--users', type=int, default=1000, help="число синтетических пользователей")
+    parser.add_argument('--concurrency', type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument('--storage', choices=STORAGE_MODES,
+                        default=os.getenv("BOOKINGS_STORAGE", "json"), help="хранилище бронирований")
+    parser.add_argument('--no-persistence', action='store_true', help="без сохранения состояния диалогов")
+    parser.add_argument('--double-tap', action='store_true',
+                        help="отправлять confirm_yes дважды одновременно (проверка защиты от дублей)")
+    parser.add_argument('--workdir', help="каталог для файлов хранилища (по умолчанию временный)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help="куда записать результаты в формате JSON")
+    return parser.parse_args()
+
+
+def read_proc_io() -> Dict[str, int]:
+    """Счётчики ввода-вывода процесса (только Linux)"""
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+def count_storage_calls(storage, counter: Counter) -> None:
+    """Подсчитывает вызовы методов хранилища бронирований"""
+    for name in ('all', 'add', 'update_status', 'delete', 'replace_all', 'get', 'by_date', 'exists'):
+        original = getattr(storage, name)
+
+        def wrapper(*args, _original=original, _name=name, **kwargs):
+            counter[_name] += 1
+            return _original(*args, **kwargs)
+
+        setattr(storage, name, wrapper)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if len(values) < 2:
+        value = values[0] * 1000 if values else 0.0
+        return {'p50': value, 'p95': value, 'p99': value, 'max': value}
+    q = statistics.quantiles(values, n=100)
+    return {'p50': q[49] * 1000, 'p95': q[94] * 1000, 'p99': q[98] * 1000, 'max': max(values) * 1000}
+
+
+def make_fake_request():
+    from telegram.request import BaseRequest
+
+    class FakeTelegramRequest(BaseRequest):
+        """Отвечает на вызовы Bot API так, как ответил бы Telegram, без сети"""
+
+        def __init__(self):
+            self.calls = Counter()
+            self._message_id = 0
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit('/', 1)[-1]
+            self.calls[api_method] += 1
+            params = request_data.parameters if request_data is not None else {}
+            if api_method == 'getMe':
+                result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+            elif api_method in ('sendMessage', 'editMessageText', 'sendDocument'):
+                self._message_id += 1
+                result = {
+                    "message_id": self._message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": params.get('chat_id') or 0, "type": "private"},
+                    "text": params.get('text', ''),
+                }
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode('utf-8')
+
+    return FakeTelegramRequest()
+
+
+class UserSimulator:
+    """Строит обновления Telegram для одного синтетического пользователя"""
+
+    def __init__(self, user_id: int, update_ids):
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "username": f"load{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+        self._update_ids = update_ids
+
+    def message(self, text: str) -> dict:
+        return {"update_id": next(self._update_ids), "message": {
+            "message_id": 1, "date": int(time.time()), "chat": self.chat, "from": self.user, "text": text,
+        }}
+
+    def callback(self, data: str) -> dict:
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(self.user['id']), "from": self.user, "chat_instance": str(self.user['id']), "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "chat": self.chat, "text": "..."},
+        }}
+
+
+async def run(args, bot_module, bookings_module) -> dict:
+    from telegram import Update
+    from schedule import LOCATIONS, LOCATION_TIMES
+
+    request = make_fake_request()
+    persistence = None
+    if not args.no_persistence:
+        from persistence import SqlitePersistence
+        persistence = SqlitePersistence()
+    application = bot_module.build_application(token="123456:LOADTEST", persistence=persistence, request=request)
+
+    storage_calls = Counter()
+    count_storage_calls(bookings_module.get_storage(), storage_calls)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    rng = random.Random(args.seed)
+    update_ids = iter(range(1, 10 ** 12))
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(user_id: int) -> None:
+        user = UserSimulator(user_id, update_ids)
+        location = rng.choice(LOCATIONS)
+        # Завтра и дальше — дата доступна при любом времени запуска
+        date = (datetime.now() + timedelta(days=rng.randint(1, 13))).strftime("%d.%m.%Y")
+        steps = [
+            ('start', user.message("Забронировать экскурсию")),
+            ('location', user.message(location)),
+            ('date', user.callback(f"date_{date}")),
+            ('time', user.callback(f"time_{rng.choice(LOCATION_TIMES[location])}")),
+            ('people', user.callback(f"people_{rng.randint(1, 6)}")),
+            ('confirm', user.callback("confirm_yes")),
+        ]
+        async with slots:
+            started = time.perf_counter()
+            for step, payload in steps:
+                payloads = [payload]
+                if step == 'confirm' and args.double_tap:
+                    payloads.append(dict(payload, update_id=next(update_ids)))
+                t0 = time.perf_counter()
+                # Тот же путь, что и у обновлений из очереди: через update_processor приложения
+                await asyncio.gather(*(
+                    application.update_processor.process_update(update, application.process_update(update))
+                    for update in (Update.de_json(p, application.bot) for p in payloads)
+                ))
+                latencies[step].append(time.perf_counter() - t0)
+            latencies['end_to_end'].append(time.perf_counter() - started)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    io_before = read_proc_io()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(simulate(100000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        io_after = read_proc_io()
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    return {
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'storage': args.storage,
+        'persistence': not args.no_persistence,
+        'concurrent_updates': application.update_processor.max_running_updates,
+        'double_tap': args.double_tap,
+        'elapsed_s': elapsed,
+        'throughput_bookings_per_s': args.users / elapsed if elapsed else 0.0,
+        'bookings_created': storage_calls['add'],
+        'latency_ms': {step: percentiles(latencies[step]) for step in STEPS + ('end_to_end',)},
+        'storage_calls': dict(storage_calls),
+        'storage_counters': {k: v for k, v in metrics.counters.items() if k.startswith('storage.')},
+        'process_io': {key: io_after[key] - io_before.get(key, 0) for key in io_after},
+        'bot_api_calls': dict(request.calls),
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"Пользователей: {result['users']}, параллельно: {result['concurrency']}, "
+          f"хранилище: {result['storage']}, persistence: {'да' if result['persistence'] else 'нет'}, "
+          f"concurrent_updates: {result['concurrent_updates']}, двойное нажатие: {'да' if result['double_tap'] else 'нет'}")
+    print(f"Время: {result['elapsed_s']:.2f} с, бронирований: {result['bookings_created']}, "
+          f"пропускная способность: {result['throughput_bookings_per_s']:.1f} брон./с")
+    print(f"{'шаг':<12}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for step, stats in result['latency_ms'].items():
+        print(f"{step:<12}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}{stats['max']:>10.2f}")
+    print("Вызовы хранилища:", ", ".join(f"{k}={v}" for k, v in sorted(result['storage_calls'].items())))
+    counters = result['storage_counters']
+    print(f"Записей на диск (fsync): {counters.get('storage.fsyncs', 0)}, групповых фиксаций: "
+          f"{counters.get('storage.commits', 0)}, изменений в них: {counters.get('storage.committed_writes', 0)}")
+    if result['process_io']:
+        io = result['process_io']
+        print(f"Ввод-вывод процесса: записано {io.get('wchar', 0)} байт за {io.get('syscw', 0)} вызовов, "
+              f"прочитано {io.get('rchar', 0)} байт за {io.get('syscr', 0)} вызовов")
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="jeeptour-loadtest-")
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    # Настройки читаются при импорте модулей бота, поэтому задаём их заранее
+    os.environ["BOOKINGS_STORAGE"] = args.storage
+    os.environ.setdefault("SEATS_PER_DEPARTURE", "1000000")
+    os.environ.setdefault("ADMIN_CHAT_IDS", "1")
+
+    import logging
+    import bookings
+    import main as bot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(run(args, bot, bookings))
+    print_report(result)
+    print(f"Файлы хранилища: {workdir}")
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
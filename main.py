@@ -1,84 +1,63 @@
 # -*- coding: utf-8 -*-
+import argparse
+import asyncio
 import logging
+import re
+import secrets
 from datetime import datetime, timedelta
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ConversationHandler, ContextTypes
-from bookings import add_booking, get_all_bookings, update_booking_status, booking_exists, delete_all_bookings, delete_booking_by_id
+from async_bookings import add_booking_if_new, query_bookings, find_bookings, get_user_bookings, cancel_user_booking, update_booking_status_many, get_departure_bookings, update_departure_status, export_bookings, delete_all_bookings, delete_booking_by_id, warm_up, archive_periodically, seats_left, calendar_keyboard, time_keyboard, shutdown as shutdown_bookings
 import os
+import tempfile
 from dotenv import load_dotenv # type: ignore
 from telegram.constants import ParseMode
+from notifications import notifier, digest, notify_admins, notify_admins_booking
+from persistence import SqlitePersistence
+from webhook import run_webhook
+from bookings import SlotFullError, ACTIVE_STATUSES
+import export
+from schedule import LOCATIONS, departure_capacity
+from keyboards import people_keyboard
+from metrics import metrics, instrument_application, start_metrics_server
+from updates import PerUserUpdateProcessor, InFlight, UserThrottle
+from reminders import ReminderScheduler
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
 ADMIN_CHAT_IDS = [int(cid) for cid in os.getenv("ADMIN_CHAT_IDS", str(os.getenv("ADMIN_CHAT_ID", "")).strip()).split(",") if cid.strip()]
-# Новый список экскурсий и расписание
-LOCATIONS = [
-    "Вершины Феодосии",
-    "Белая Скала",
-    "Арпатские водопады",
-    "Меганом и мысы Судака"
-]
-LOCATION_TIMES = {
-    "Вершины Феодосии": ["09:00", "13:00", "17:00"],
-    "Белая Скала": ["08:00", "14:00"],
-    "Арпатские водопады": ["08:00", "14:00"],
-    "Меганом и мысы Судака": ["08:00", "14:00"]
-}
-
 # Состояния для ConversationHandler
 (LOCATION, TIME, PEOPLE, CONFIRM, FINAL) = range(5)
 
 # Словарь для хранения временных запросов на удаление (chat_id: action)
 pending_deletions = {}
 
-def generate_calendar_keyboard(context=None):
+# Напоминания клиентам и утренний список туров для админов
+reminder_scheduler = ReminderScheduler(ADMIN_CHAT_IDS)
+
+# Ограничение частоты обновлений от одного пользователя (у админов лимит выше)
+throttle = UserThrottle(ADMIN_CHAT_IDS)
+
+# Бронирования, которые сейчас сохраняются: повторное нажатие «Да» не создаст второе
+booking_inflight = InFlight()
+
+# Отдельный эндпоинт /metrics (если задан METRICS_PORT)
+metrics_server = None
+# Фоновая архивация прошедших туров
+archive_task = None
+
+async def generate_calendar_keyboard(context=None):
     """Генерирует клавиатуру с датами на ближайшие 14 дней, исключая сегодняшнюю дату если все времена уже прошли для выбранной локации."""
-    keyboard = []
-    current_date = datetime.now()
-    ru_weekdays = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-    # Получаем выбранную локацию, если context передан
     location = None
-    times_for_location = None
     if context and hasattr(context, 'user_data'):
         location = context.user_data.get('location')
-        times_for_location = LOCATION_TIMES.get(location, None)
-    for i in range(14):
-        date = current_date + timedelta(days=i)
-        date_str = date.strftime("%d.%m.%Y")
-        day_name = ru_weekdays[date.weekday()]
-        if date.date() < current_date.date():
-            continue
-        # Исключаем "Сегодня", если все времена уже прошли для выбранной локации
-        if i == 0 and times_for_location:
-            now = current_date
-            times_left = [t for t in times_for_location if datetime.strptime(t, "%H:%M").time() > now.time()]
-            if not times_left:
-                continue
-            button_text = f"Сегодня ({date_str})"
-        elif i == 0:
-            button_text = f"Сегодня ({date_str})"
-        elif i == 1:
-            button_text = f"Завтра ({date_str})"
-        else:
-            button_text = f"{day_name} {date_str}"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"date_{date_str}")])
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel")])
-    return InlineKeyboardMarkup(keyboard)
+    return await calendar_keyboard(location)
 
-def generate_people_keyboard():
+def generate_people_keyboard(max_people=6):
     """Генерирует клавиатуру для выбора количества пассажиров"""
-    keyboard = []
-    
-    # Создаем кнопки от 1 до 6 пассажиров
-    for i in range(1, 7):
-        keyboard.append([InlineKeyboardButton(f"{i} {'человек' if i == 1 else 'человека' if i < 5 else 'человек'}", callback_data=f"people_{i}")])
-    
-    # Добавляем кнопку "Отмена"
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel")])
-    
-    return InlineKeyboardMarkup(keyboard)
+    return people_keyboard(max_people)
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
@@ -107,7 +86,7 @@ async def handle_location_selection(update: Update, context: ContextTypes.DEFAUL
     context.user_data['location'] = update.message.text
     await update.message.reply_text(
         f"📍 Выбрана локация: {update.message.text}\n\nВыбери дату:",
-        reply_markup=generate_calendar_keyboard(context)
+        reply_markup=await generate_calendar_keyboard(context)
     )
     return TIME
 
@@ -132,22 +111,11 @@ async def handle_date_selection(update: Update, context: ContextTypes.DEFAULT_TY
     if query.data.startswith("date_"):
         selected_date = query.data.replace("date_", "")
         context.user_data['date'] = selected_date
-        # Получаем выбранную локацию
+        # Если выбрана сегодняшняя дата, клавиатура содержит только будущие времена
         location = context.user_data.get('location')
-        times_for_location = LOCATION_TIMES.get(location, [])
-        # Если выбрана сегодняшняя дата, показываем только будущие времена
-        from datetime import datetime
-        date_obj = datetime.strptime(selected_date, "%d.%m.%Y")
-        now = datetime.now()
-        if date_obj.date() == now.date():
-            available_times = [t for t in times_for_location if datetime.strptime(t, "%H:%M").time() > now.time()]
-        else:
-            available_times = times_for_location
-        time_keyboard = [[InlineKeyboardButton(t, callback_data=f"time_{t}")] for t in available_times]
-        time_keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel")])
         await query.edit_message_text(
             f"📅 Выбрана дата: {selected_date}\n\nВыбери время:",
-            reply_markup=InlineKeyboardMarkup(time_keyboard)
+            reply_markup=await time_keyboard(location, selected_date)
         )
         return PEOPLE
     return TIME
@@ -208,11 +176,19 @@ async def handle_time_selection(update: Update, context: ContextTypes.DEFAULT_TY
     
     if query.data.startswith("time_"):
         selected_time = query.data.replace("time_", "")
+        location = context.user_data.get('location')
+        free_seats = await seats_left(location, context.user_data['date'], selected_time)
+        if free_seats <= 0:
+            await query.edit_message_text(
+                "❗️На это время мест не осталось. Выбери другое время:",
+                reply_markup=await time_keyboard(location, context.user_data['date'])
+            )
+            return PEOPLE
         context.user_data['time'] = selected_time
         
         await query.edit_message_text(
             f"⏰ Выбрано время: {selected_time}\n\nВыбери количество пассажиров:",
-            reply_markup=generate_people_keyboard()
+            reply_markup=generate_people_keyboard(free_seats)
         )
         return CONFIRM
     
@@ -220,18 +196,6 @@ async def handle_time_selection(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['people'] = update.message.text
-    # Проверка на дубликат
-    if booking_exists(
-        update.message.from_user.id,
-        context.user_data['location'],
-        context.user_data['date'],
-        context.user_data['time']
-    ):
-        await update.message.reply_text(
-            "❗️Вы уже забронировали эту экскурсию на выбранное время!"
-        )
-        return ConversationHandler.END
-    # Сохраняем бронирование
     booking_data = {
         'location': context.user_data['location'],
         'date': context.user_data['date'],
@@ -243,7 +207,25 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'chat_id': update.message.chat_id
     }
     
-    saved_booking = add_booking(booking_data)
+    # Сохраняем бронирование (с проверкой на дубликат и свободные места)
+    slot_key = (booking_data['user_id'], booking_data['location'], booking_data['date'], booking_data['time'])
+    if not booking_inflight.claim(slot_key):
+        # Повторное нажатие, пока первое ещё обрабатывается
+        return ConversationHandler.END
+    try:
+        saved_booking = await add_booking_if_new(booking_data, departure_capacity(booking_data['location']))
+    except SlotFullError:
+        await update.message.reply_text(
+            "❗️К сожалению, на это время не осталось свободных мест."
+        )
+        return ConversationHandler.END
+    finally:
+        booking_inflight.release(slot_key)
+    if saved_booking is None:
+        await update.message.reply_text(
+            "❗️Вы уже забронировали эту экскурсию на выбранное время!"
+        )
+        return ConversationHandler.END
     
     booking_info = (
         f"ID: #{saved_booking['id']}\n"
@@ -260,21 +242,13 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Мы свяжемся с вами для подтверждения."
     )
     
+    reminder_scheduler.schedule(saved_booking)
+
     # Отправка уведомления админу
     admin_message = f"🚗 НОВОЕ БРОНИРОВАНИЕ ДЖИП-ТУРА #{saved_booking['id']}\n\n{booking_info}"
     
-    ADMIN_CHAT_IDS = [int(cid) for cid in os.getenv("ADMIN_CHAT_IDS", str(os.getenv("ADMIN_CHAT_ID", "")).strip()).split(",") if cid.strip()]
-    
-    # Отправляем уведомление всем администраторам
-    for admin_id in ADMIN_CHAT_IDS:
-        try:
-            await context.bot.send_message(chat_id=admin_id, text=admin_message)
-            print(f"✅ Уведомление отправлено админу (chat_id: {admin_id})")
-        except Exception as e:
-            print(f"❌ Ошибка отправки админу {admin_id}: {e}")
-            print(f"=== НОВОЕ БРОНИРОВАНИЕ ===")
-            print(admin_message)
-            print("==========================")
+    # Ставим уведомление в очередь: доставку выполняет фоновая задача
+    await notify_admins_booking(ADMIN_CHAT_IDS, saved_booking, admin_message)
     
     return ConversationHandler.END
 
@@ -288,18 +262,6 @@ async def handle_confirm_booking(update: Update, context: ContextTypes.DEFAULT_T
         return ConversationHandler.END
     
     if query.data == "confirm_yes":
-        # Проверка на дубликат
-        if booking_exists(
-            query.from_user.id,
-            context.user_data['location'],
-            context.user_data['date'],
-            context.user_data['time']
-        ):
-            await query.edit_message_text(
-                "❗️Вы уже забронировали эту экскурсию на выбранное время!"
-            )
-            return ConversationHandler.END
-        # Сохраняем бронирование
         booking_data = {
             'location': context.user_data['location'],
             'date': context.user_data['date'],
@@ -311,7 +273,25 @@ async def handle_confirm_booking(update: Update, context: ContextTypes.DEFAULT_T
             'chat_id': query.message.chat_id
         }
         
-        saved_booking = add_booking(booking_data)
+        # Сохраняем бронирование (с проверкой на дубликат и свободные места)
+        slot_key = (booking_data['user_id'], booking_data['location'], booking_data['date'], booking_data['time'])
+        if not booking_inflight.claim(slot_key):
+            # Повторное нажатие, пока первое ещё обрабатывается
+            return ConversationHandler.END
+        try:
+            saved_booking = await add_booking_if_new(booking_data, departure_capacity(booking_data['location']))
+        except SlotFullError:
+            await query.edit_message_text(
+                "❗️К сожалению, на это время не осталось свободных мест."
+            )
+            return ConversationHandler.END
+        finally:
+            booking_inflight.release(slot_key)
+        if saved_booking is None:
+            await query.edit_message_text(
+                "❗️Вы уже забронировали эту экскурсию на выбранное время!"
+            )
+            return ConversationHandler.END
         
         booking_info = (
             f"ID: #{saved_booking['id']}\n"
@@ -328,21 +308,13 @@ async def handle_confirm_booking(update: Update, context: ContextTypes.DEFAULT_T
             f"Мы свяжемся с вами для подтверждения."
         )
         
+        reminder_scheduler.schedule(saved_booking)
+
         # Отправка уведомления админу
         admin_message = f"🚗 НОВОЕ БРОНИРОВАНИЕ ДЖИП-ТУРА #{saved_booking['id']}\n\n{booking_info}"
         
-        ADMIN_CHAT_IDS = [int(cid) for cid in os.getenv("ADMIN_CHAT_IDS", str(os.getenv("ADMIN_CHAT_ID", "")).strip()).split(",") if cid.strip()]
-        
-        # Отправляем уведомление всем администраторам
-        for admin_id in ADMIN_CHAT_IDS:
-            try:
-                await context.bot.send_message(chat_id=admin_id, text=admin_message)
-                print(f"✅ Уведомление отправлено админу (chat_id: {admin_id})")
-            except Exception as e:
-                print(f"❌ Ошибка отправки админу {admin_id}: {e}")
-                print(f"=== НОВОЕ БРОНИРОВАНИЕ ===")
-                print(admin_message)
-                print("==========================")
+        # Ставим уведомление в очередь: доставку выполняет фоновая задача
+        await notify_admins_booking(ADMIN_CHAT_IDS, saved_booking, admin_message)
         
         return ConversationHandler.END
     
@@ -413,35 +385,235 @@ async def get_my_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(message)
 
+BOOKINGS_PAGE_SIZE = 10
+BOOKING_STATUSES = ('new', 'confirmed', 'cancelled')
+
+def format_booking_entry(booking):
+    """Форматирует одно бронирование для списка администратора"""
+    status_emoji = "🆕" if booking.get('status') == 'new' else "✅" if booking.get('status') == 'confirmed' else "❌"
+    return (
+        f"{status_emoji} #{booking['id']} - {booking['location']}\n"
+        f"📅 {booking['date']} в {booking['time']}\n"
+        f"👥 {booking['people']} чел. | @{booking['username']}\n"
+        f"⏰ {booking['timestamp'][:16].replace('T', ' ')}\n\n"
+    )
+
+async def render_bookings_page(page, date=None, status=None):
+    """Возвращает текст и клавиатуру одной страницы списка бронирований"""
+    page = max(page, 0)
+    total, page_bookings = await query_bookings(date, status, page * BOOKINGS_PAGE_SIZE, BOOKINGS_PAGE_SIZE)
+    if not total:
+        return "📋 Бронирований не найдено." if date or status else "📋 Бронирований пока нет.", None
+    pages = (total + BOOKINGS_PAGE_SIZE - 1) // BOOKINGS_PAGE_SIZE
+    if page >= pages:
+        # Пока листали, часть бронирований исчезла — показываем последнюю страницу
+        page = pages - 1
+        total, page_bookings = await query_bookings(date, status, page * BOOKINGS_PAGE_SIZE, BOOKINGS_PAGE_SIZE)
+    filters_text = " ".join(f for f in (date, status) if f)
+    header = f"📋 Бронирования{' (' + filters_text + ')' if filters_text else ''}: {total}, стр. {page + 1}/{pages}\n\n"
+    message = header + "".join(format_booking_entry(b) for b in page_bookings)
+    # Фильтры передаются в callback_data, чтобы листать без хранения состояния
+    suffix = f"{date or '-'}:{status or '-'}"
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"bookings_page:{page - 1}:{suffix}"))
+    if page + 1 < pages:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"bookings_page:{page + 1}:{suffix}"))
+    return message, InlineKeyboardMarkup([buttons]) if buttons else None
+
 async def show_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда для просмотра всех бронирований (только для админа)"""
+    """Команда для просмотра бронирований по страницам (только для админа).
+
+    Пример: /bookings 20.07.2025 new — фильтр по дате и/или статусу.
+    """
     # Проверяем, что это админ
-    if update.message.chat_id != ADMIN_CHAT_IDS[0]:  # Твой chat_id
+    if update.message.chat_id not in ADMIN_CHAT_IDS:
         await update.message.reply_text("❌ У вас нет доступа к этой команде.")
         return
     
-    bookings = get_all_bookings()
-    
-    if not bookings:
-        await update.message.reply_text("📋 Бронирований пока нет.")
+    date = status = None
+    for arg in context.args or []:
+        if arg in BOOKING_STATUSES:
+            status = arg
+        else:
+            date = arg
+    message, markup = await render_bookings_page(0, date, status)
+    await update.message.reply_text(message, reply_markup=markup)
+
+async def handle_bookings_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание списка бронирований: редактирует сообщение на месте"""
+    query = update.callback_query
+    await query.answer()
+    if query.message.chat_id not in ADMIN_CHAT_IDS:
         return
-    
-    message = "📋 Список всех бронирований:\n\n"
-    
-    for booking in bookings:
-        status_emoji = "🆕" if booking.get('status') == 'new' else "✅" if booking.get('status') == 'confirmed' else "❌"
-        message += f"{status_emoji} #{booking['id']} - {booking['location']}\n"
-        message += f"📅 {booking['date']} в {booking['time']}\n"
-        message += f"👥 {booking['people']} чел. | @{booking['username']}\n"
-        message += f"⏰ {booking['timestamp'][:16].replace('T', ' ')}\n\n"
-    
-    # Разбиваем на части, если сообщение слишком длинное
-    if len(message) > 4096:
-        parts = [message[i:i+4096] for i in range(0, len(message), 4096)]
-        for part in parts:
-            await update.message.reply_text(part)
-    else:
-        await update.message.reply_text(message)
+    _, page, date, status = query.data.split(":")
+    message, markup = await render_bookings_page(
+        int(page), None if date == '-' else date, None if status == '-' else status
+    )
+    await query.edit_message_text(message, reply_markup=markup)
+
+def resolve_location(text):
+    """Локация, название которой начинается с text (без учёта регистра); None, если такой нет"""
+    return next((loc for loc in LOCATIONS if loc.lower().startswith(text.lower())), None)
+
+def parse_find_query(args):
+    """Разбирает аргументы /find в условия поиска; None, если условий нет"""
+    criteria = {}
+    dates, words = [], []
+    for arg in args:
+        if arg.startswith('@') and len(arg) > 1:
+            criteria['username'] = arg
+        elif arg.isdigit():
+            criteria['user_id'] = int(arg)
+        elif arg in BOOKING_STATUSES:
+            criteria['status'] = arg
+        elif re.fullmatch(r'\d{2}\.\d{2}\.\d{4}(-\d{2}\.\d{2}\.\d{4})?', arg):
+            dates += arg.split('-')
+        else:
+            words.append(arg)
+    if dates:
+        criteria['date_from'] = dates[0]
+        criteria['date_to'] = dates[-1]
+    if words:
+        text = " ".join(words)
+        location = resolve_location(text)
+        if location is not None:
+            criteria['location'] = location
+        else:
+            criteria['name'] = text
+    return criteria or None
+
+async def render_find_page(criteria, page, nonce):
+    """Возвращает текст и клавиатуру одной страницы результатов /find"""
+    total, page_bookings = await find_bookings(page * BOOKINGS_PAGE_SIZE, BOOKINGS_PAGE_SIZE, **criteria)
+    if not total:
+        return "🔍 Ничего не найдено.", None
+    pages = (total + BOOKINGS_PAGE_SIZE - 1) // BOOKINGS_PAGE_SIZE
+    if page >= pages:
+        # Пока листали, часть результатов исчезла — показываем последнюю страницу
+        page = pages - 1
+        total, page_bookings = await find_bookings(page * BOOKINGS_PAGE_SIZE, BOOKINGS_PAGE_SIZE, **criteria)
+    header = f"🔍 Найдено: {total}, стр. {page + 1}/{pages}\n\n"
+    message = header + "".join(
+        f"{format_booking_entry(b).rstrip()}\n👤 {b.get('first_name') or '-'} (id {b.get('user_id')})\n\n"
+        for b in page_bookings
+    )
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"find_page:{nonce}:{page - 1}"))
+    if page + 1 < pages:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"find_page:{nonce}:{page + 1}"))
+    return message, InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск бронирований (только для админа).
+
+    Пример: /find @username, /find 123456789, /find Иван 01.07.2025-31.07.2025 confirmed
+    """
+    if update.message.chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    criteria = parse_find_query(context.args or [])
+    if criteria is None:
+        await update.message.reply_text(
+            "Использование: /find [@username] [user_id] [имя или локация] [дата или с-по] [статус]\n"
+            "Например: /find Иван 01.07.2025-31.07.2025 confirmed"
+        )
+        return
+    # Условия последнего поиска нужны для листания; в callback_data они могут не поместиться,
+    # поэтому кнопки несут только метку поиска, чтобы старое сообщение не листало новый
+    nonce = secrets.token_hex(4)
+    context.chat_data['find'] = {'nonce': nonce, 'criteria': criteria}
+    message, markup = await render_find_page(criteria, 0, nonce)
+    await update.message.reply_text(message, reply_markup=markup)
+
+async def handle_find_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание результатов /find: редактирует сообщение на месте"""
+    query = update.callback_query
+    await query.answer()
+    if query.message.chat_id not in ADMIN_CHAT_IDS:
+        return
+    _, nonce, page = query.data.split(":")
+    search = context.chat_data.get('find')
+    if search is None or search['nonce'] != nonce:
+        await query.edit_message_text("🔍 Поиск устарел, повторите /find.")
+        return
+    message, markup = await render_find_page(search['criteria'], int(page), nonce)
+    await query.edit_message_text(message, reply_markup=markup)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка бронирований файлом (только для админа).
+
+    Пример: /export 01.07.2025 31.07.2025 confirmed xlsx — все аргументы необязательны.
+    """
+    if update.message.chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    dates = []
+    status = None
+    fmt = 'csv'
+    for arg in context.args or []:
+        if arg in BOOKING_STATUSES:
+            status = arg
+        elif arg.lower() in ('csv', 'xlsx'):
+            fmt = arg.lower()
+        else:
+            try:
+                datetime.strptime(arg, "%d.%m.%Y")
+            except ValueError:
+                # Иначе опечатка в дате молча выгрузила бы все бронирования
+                await update.message.reply_text(
+                    f"❌ Не понял аргумент «{arg}». Даты — в формате ДД.ММ.ГГГГ.\n"
+                    "Пример: /export 01.07.2025 31.07.2025 confirmed xlsx"
+                )
+                return
+            dates.append(arg)
+    if len(dates) > 2:
+        await update.message.reply_text("❌ Укажите не больше двух дат: начало и конец периода.")
+        return
+    if fmt == 'xlsx' and not export.xlsx_available():
+        await update.message.reply_text("❌ Выгрузка в XLSX недоступна: установите openpyxl.")
+        return
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else date_from
+
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        count = await export_bookings(path, fmt, date_from, date_to, status)
+        if not count:
+            await update.message.reply_text("📋 Бронирований не найдено.")
+            return
+        with open(path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"bookings_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}",
+                caption=f"📋 Выгружено бронирований: {count}"
+            )
+    finally:
+        os.remove(path)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Счётчики и задержки обработчиков, хранилища и уведомлений (только для админа)"""
+    if update.message.chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    uptime = timedelta(seconds=int(datetime.now().timestamp() - metrics.started_at))
+    sections = [
+        f"📊 Статистика за {uptime}",
+        "\nОбработчики:", *(metrics.render_text("handler.") or ["нет данных"]),
+        "\nБронирования:", *(metrics.render_text("bookings.") or ["нет данных"]),
+        "\nХранилище:",
+        f"прочитано {metrics.counters['storage.bytes_read'] / 1024:.1f} КБ, "
+        f"записано {metrics.counters['storage.bytes_written'] / 1024:.1f} КБ",
+        f"fsync: {metrics.counters['storage.fsyncs']}, групповых фиксаций: {metrics.counters['storage.commits']} "
+        f"({metrics.counters['storage.committed_writes']} изменений)",
+        "\nУведомления:", *(metrics.render_text("notify.") or ["нет данных"]),
+        f"в очереди: {notifier.pending}",
+    ]
+    text = "\n".join(sections)
+    # Ограничение Telegram на длину сообщения
+    await update.message.reply_text(text[:4000])
 
 async def channel_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для получения информации о канале"""
@@ -496,6 +668,184 @@ async def get_channel_info_direct(update: Update, context: ContextTypes.DEFAULT_
         print(f"Ошибка: {e}")
         await update.message.reply_text(error_message)
 
+# Сколько ближайших бронирований показывать клиенту в /my_bookings
+MY_BOOKINGS_LIMIT = 20
+
+async def render_my_bookings(user_id):
+    """Возвращает текст и клавиатуру со списком предстоящих бронирований клиента"""
+    user_bookings = await get_user_bookings(user_id, upcoming_only=True)
+    if not user_bookings:
+        return "У вас нет предстоящих бронирований. Напишите /start, чтобы забронировать экскурсию.", None
+    shown = user_bookings[:MY_BOOKINGS_LIMIT]
+    lines = ["🗓 Ваши предстоящие экскурсии:\n"]
+    for b in shown:
+        status = "✅ подтверждено" if b.get('status') == 'confirmed' else "🆕 ожидает подтверждения"
+        lines.append(f"#{b['id']} — {b['location']}\n📅 {b['date']} в {b['time']}, 👥 {b['people']} чел., {status}\n")
+    if len(user_bookings) > len(shown):
+        lines.append(f"…и ещё {len(user_bookings) - len(shown)}")
+    keyboard = [[InlineKeyboardButton(f"❌ Отменить #{b['id']}", callback_data=f"my_cancel:{b['id']}")] for b in shown]
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def my_bookings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Предстоящие бронирования клиента с кнопками отмены"""
+    message, markup = await render_my_bookings(update.effective_user.id)
+    await update.message.reply_text(message, reply_markup=markup)
+
+async def handle_my_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмена бронирования клиентом: запрос подтверждения, отмена, возврат к списку"""
+    query = update.callback_query
+    await query.answer()
+    user = query.from_user
+    action, _, booking_id = query.data.partition(":")
+    if action == "my_cancel":
+        keyboard = [
+            [InlineKeyboardButton("Да, отменить", callback_data=f"my_cancel_yes:{booking_id}")],
+            [InlineKeyboardButton("Нет", callback_data="my_bookings")]
+        ]
+        await query.edit_message_text(
+            f"⚠️ Отменить бронирование #{booking_id}?",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    if action == "my_cancel_yes":
+        booking = await cancel_user_booking(int(booking_id), user.id)
+        if booking is None:
+            await query.edit_message_text(
+                f"❗️Бронирование #{booking_id} нельзя отменить: оно уже отменено или тур начался."
+            )
+            return
+        reminder_scheduler.unschedule(booking['id'])
+        metrics.inc('bookings.self_cancelled')
+        await query.edit_message_text(f"❌ Бронирование #{booking['id']} отменено.")
+        await notify_admins(ADMIN_CHAT_IDS, (
+            f"❌ КЛИЕНТ ОТМЕНИЛ БРОНИРОВАНИЕ #{booking['id']}\n\n"
+            f"Локация: {booking['location']}\n"
+            f"Дата: {booking['date']}\n"
+            f"Время: {booking['time']}\n"
+            f"Количество человек: {booking['people']}\n"
+            f"Пользователь: @{user.username} ({user.first_name})"
+        ))
+        return
+    message, markup = await render_my_bookings(user.id)
+    await query.edit_message_text(message, reply_markup=markup)
+
+# --- Массовая смена статуса ---
+
+STATUS_NAMES = {'new': 'новое', 'confirmed': 'подтверждено', 'cancelled': 'отменено'}
+
+def customer_status_message(booking, status):
+    """Текст уведомления клиенту о смене статуса его бронирования"""
+    details = f"Локация: {booking['location']}\nДата: {booking['date']}\nВремя: {booking['time']}"
+    if status == 'confirmed':
+        return f"✅ Ваше бронирование #{booking['id']} подтверждено!\n\n{details}\n\nЖдём вас!"
+    if status == 'cancelled':
+        return (
+            f"❌ К сожалению, экскурсия по вашему бронированию #{booking['id']} отменена.\n\n{details}\n\n"
+            f"Напишите /start, чтобы выбрать другое время."
+        )
+    return f"ℹ️ Статус бронирования #{booking['id']} изменён: {STATUS_NAMES.get(status, status)}.\n\n{details}"
+
+def bulk_status_keyboard(nonce):
+    # Метка запроса в кнопках: «Да» под старым запросом не применит более новый
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Да", callback_data=f"bulk_status:{nonce}:yes")],
+        [InlineKeyboardButton("Да и уведомить клиентов", callback_data=f"bulk_status:{nonce}:notify")],
+        [InlineKeyboardButton("Нет", callback_data=f"bulk_status:{nonce}:no")]
+    ])
+
+async def set_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Смена статуса нескольких бронирований по ID (только для админа).
+
+    Пример: /set_status confirmed 12 15 16
+    """
+    if update.message.chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    args = context.args or []
+    if len(args) < 2 or args[0] not in BOOKING_STATUSES or not all(a.isdigit() for a in args[1:]):
+        await update.message.reply_text(
+            "Использование: /set_status <new|confirmed|cancelled> <id> [id ...]\n"
+            "Например: /set_status confirmed 12 15 16"
+        )
+        return
+    status, booking_ids = args[0], [int(a) for a in args[1:]]
+    nonce = secrets.token_hex(4)
+    context.chat_data['bulk_status'] = {'nonce': nonce, 'status': status, 'ids': booking_ids}
+    await update.message.reply_text(
+        f"⚠️ Установить статус «{STATUS_NAMES[status]}» для бронирований "
+        f"{', '.join(f'#{i}' for i in booking_ids)}?",
+        reply_markup=bulk_status_keyboard(nonce)
+    )
+
+async def departure_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Смена статуса всех бронирований отправления (только для админа).
+
+    Пример: /departure_status cancelled 20.07.2025 08:00 Белая Скала
+    """
+    if update.message.chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    args = context.args or []
+    location = resolve_location(" ".join(args[3:])) if len(args) > 3 else None
+    if (len(args) < 4 or args[0] not in BOOKING_STATUSES or location is None
+            or not re.fullmatch(r'\d{2}\.\d{2}\.\d{4}', args[1]) or not re.fullmatch(r'\d{2}:\d{2}', args[2])):
+        await update.message.reply_text(
+            "Использование: /departure_status <new|confirmed|cancelled> <ДД.ММ.ГГГГ> <ЧЧ:ММ> <локация>\n"
+            "Например: /departure_status cancelled 20.07.2025 08:00 Белая Скала"
+        )
+        return
+    status, date, time_str = args[0], args[1], args[2]
+    departure_bookings = await get_departure_bookings(location, date, time_str)
+    if not departure_bookings:
+        await update.message.reply_text(f"📋 На {date} {time_str}, {location} активных бронирований нет.")
+        return
+    people = sum(int(b.get('people') or 0) for b in departure_bookings)
+    nonce = secrets.token_hex(4)
+    context.chat_data['bulk_status'] = {'nonce': nonce, 'status': status, 'departure': [location, date, time_str]}
+    await update.message.reply_text(
+        f"⚠️ Установить статус «{STATUS_NAMES[status]}» для всех активных бронирований на "
+        f"{date} {time_str}, {location}? Бронирований: {len(departure_bookings)}, человек: {people}.",
+        reply_markup=bulk_status_keyboard(nonce)
+    )
+
+async def handle_bulk_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Применяет массовую смену статуса одной транзакцией и при желании уведомляет клиентов"""
+    query = update.callback_query
+    await query.answer()
+    if query.message.chat_id not in ADMIN_CHAT_IDS:
+        return
+    _, nonce, action = query.data.split(":")
+    pending = context.chat_data.get('bulk_status')
+    if pending is None or pending['nonce'] != nonce:
+        await query.edit_message_text("⚠️ Запрос устарел, повторите команду.")
+        return
+    del context.chat_data['bulk_status']
+    if action == "no":
+        await query.message.delete()
+        return
+    status = pending['status']
+    if 'departure' in pending:
+        # Список бронирований берётся заново: пока админ думал, могли появиться новые
+        changed, full = await update_departure_status(*pending['departure'], status), []
+    else:
+        changed, full = await update_booking_status_many(pending['ids'], status, departure_capacity)
+    for booking in changed:
+        if status in ACTIVE_STATUSES:
+            reminder_scheduler.schedule(booking)
+        else:
+            reminder_scheduler.unschedule(booking['id'])
+    text = f"✅ Статус «{STATUS_NAMES[status]}» установлен для бронирований: {len(changed)}"
+    if full:
+        full_ids = ', '.join(f"#{b['id']}" for b in full)
+        text += f"\n❗️Не хватает мест на отправлении, статус не изменён: {full_ids}"
+    if action == "notify":
+        # Очередь уведомлений сама соблюдает лимиты Telegram на отправку
+        messages = [(b['chat_id'], customer_status_message(b, status)) for b in changed if b.get('chat_id')]
+        await notifier.enqueue_many(messages)
+        metrics.inc('bulk_status.notified', len(messages))
+        text += f"\n📨 Уведомлений клиентам в очереди: {len(messages)}"
+    await query.edit_message_text(text)
+
 # --- Новые функции для удаления бронирований ---
 async def clear_bookings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Только для админа
@@ -540,7 +890,7 @@ async def handle_delete_confirm(update: Update, context: ContextTypes.DEFAULT_TY
     data = query.data
     # Удаление всех бронирований
     if data == "confirm_clear_all":
-        delete_all_bookings()
+        await delete_all_bookings()
         await query.edit_message_text("✅ Все бронирования удалены.")
         pending_deletions.pop(chat_id, None)
     elif data == "cancel_clear_all":
@@ -549,7 +899,8 @@ async def handle_delete_confirm(update: Update, context: ContextTypes.DEFAULT_TY
     # Удаление одного бронирования
     elif data.startswith("confirm_delete_"):
         booking_id = int(data.replace("confirm_delete_", ""))
-        if delete_booking_by_id(booking_id):
+        if await delete_booking_by_id(booking_id):
+            reminder_scheduler.unschedule(booking_id)
             await query.edit_message_text(f"✅ Бронирование #{booking_id} удалено.")
         else:
             await query.edit_message_text(f"❌ Бронирование #{booking_id} не найдено.")
@@ -566,9 +917,15 @@ async def commands_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "<b>Доступные команды (админ):</b>\n"
             "/start — начать бронирование\n"
             "/clear — очистить данные пользователя и сбросить состояние\n"
-            "/bookings — посмотреть все бронирования\n"
+            "/my_bookings — мои бронирования и их отмена\n"
+            "/bookings [дата] [статус] — посмотреть бронирования по страницам\n"
+            "/find [@username] [user_id] [имя или локация] [дата или с-по] [статус] — найти бронирования\n"
+            "/export [с] [по] [статус] [csv|xlsx] — выгрузить бронирования файлом\n"
+            "/stats — счётчики и задержки бота\n"
             "/clear_bookings — удалить все бронирования\n"
             "/delete_booking &lt;id&gt; — удалить бронирование по номеру\n"
+            "/set_status &lt;статус&gt; &lt;id&gt; [id ...] — сменить статус нескольких бронирований\n"
+            "/departure_status &lt;статус&gt; &lt;дата&gt; &lt;время&gt; &lt;локация&gt; — сменить статус всего отправления\n"
             "/channel_info — информация о канале\n"
             "/get_channel_info — информация о канале через API\n"
             "/get_my_id — узнать свой chat_id\n"
@@ -579,6 +936,7 @@ async def commands_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "<b>Доступные команды:</b>\n"
             "/start — начать бронирование\n"
             "/clear — очистить данные пользователя и сбросить состояние\n"
+            "/my_bookings — мои бронирования и их отмена\n"
             "/get_my_id — узнать свой chat_id\n"
             "/commands — список команд"
         )
@@ -586,19 +944,81 @@ async def commands_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Удаляем обработчик сообщений из каналов и связанные функции
 
-def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+async def post_init(application: Application):
+    """Загружает бронирования и запускает отправку уведомлений до приёма первых обновлений"""
+    global metrics_server, archive_task
+    await warm_up()
+    await notifier.start(application.bot)
+    await digest.start()
+    await reminder_scheduler.start()
+    metrics_server = await start_metrics_server()
+    archive_task = asyncio.create_task(archive_periodically())
+
+async def post_shutdown(application: Application):
+    """Завершает отправку уведомлений и операции с хранилищем при остановке бота"""
+    global metrics_server, archive_task
+    if archive_task is not None:
+        archive_task.cancel()
+        try:
+            await archive_task
+        except asyncio.CancelledError:
+            pass
+        archive_task = None
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+        metrics_server = None
+    await reminder_scheduler.stop()
+    # Накопленная сводка уходит в outbox до его закрытия
+    await digest.stop()
+    await digest.flush_all()
+    await notifier.stop()
+    shutdown_bookings()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Телеграм-бот для бронирования джип-туров")
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default=os.getenv("BOT_MODE", "polling"),
+                        help="получение обновлений: long polling или webhook (по умолчанию polling)")
+    parser.add_argument('--no-set-webhook', action='store_true',
+                        help="не вызывать setWebhook (для локальной отладки webhook-режима)")
+    return parser.parse_args()
+
+def build_application(token=None, persistence=None, request=None):
+    """Создаёт Application со всеми обработчиками бота.
+
+    request позволяет подменить HTTP-клиент Telegram (например, в нагрузочном тесте).
+    """
+    builder = (
+        Application.builder().token(token or BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+        # Разные пользователи обслуживаются параллельно, обновления одного — по порядку
+        .concurrent_updates(PerUserUpdateProcessor(throttle=throttle))
+    )
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
 
     # Добавляем обработчики команд для пользователя и администраторов
     application.add_handler(CommandHandler('get_my_id', get_my_id))
     application.add_handler(CommandHandler('bookings', show_bookings))
+    application.add_handler(CommandHandler('find', find_command))
+    application.add_handler(CommandHandler('my_bookings', my_bookings_command))
+    application.add_handler(CommandHandler('export', export_command))
+    application.add_handler(CommandHandler('stats', stats_command))
     application.add_handler(CommandHandler('clear', clear))
     application.add_handler(CommandHandler('channel_info', channel_info))
     application.add_handler(CommandHandler('get_channel_info', get_channel_info_direct))
     application.add_handler(CommandHandler('start', start_command))
     application.add_handler(CommandHandler('clear_bookings', clear_bookings_command))
     application.add_handler(CommandHandler('delete_booking', delete_booking_command))
+    application.add_handler(CommandHandler('set_status', set_status_command))
+    application.add_handler(CommandHandler('departure_status', departure_status_command))
     application.add_handler(CommandHandler('commands', commands_command))
+    application.add_handler(CallbackQueryHandler(handle_bookings_page, pattern=r'^bookings_page:\d+:'))
+    application.add_handler(CallbackQueryHandler(handle_find_page, pattern=r'^find_page:[0-9a-f]+:\d+$'))
+    application.add_handler(CallbackQueryHandler(handle_bulk_status, pattern=r'^bulk_status:[0-9a-f]+:(yes|notify|no)$'))
+    application.add_handler(CallbackQueryHandler(handle_my_bookings, pattern=r'^(my_cancel:\d+|my_cancel_yes:\d+|my_bookings)$'))
     application.add_handler(CallbackQueryHandler(handle_delete_confirm, pattern=r'^(confirm_clear_all|cancel_clear_all|confirm_delete_\d+|cancel_delete_\d+)$'))
 
     # ConversationHandler только для личного бронирования
@@ -612,11 +1032,24 @@ def main():
             FINAL: [CallbackQueryHandler(handle_confirm_booking)],
         },
         fallbacks=[CommandHandler('cancel', cancel), CommandHandler('clear', clear)],
-        allow_reentry=True
+        allow_reentry=True,
+        # Состояние диалога переживает перезапуск бота
+        name="booking",
+        persistent=application.persistence is not None
     )
     application.add_handler(conv_handler)
+    # Счётчики вызовов, ошибок и задержек для /stats и /metrics
+    instrument_application(application)
+    return application
+
+def main():
+    args = parse_args()
+    application = build_application(persistence=SqlitePersistence())
     print("Бот запущен. Нажмите Ctrl+C для остановки.")
-    application.run_polling()
+    if args.mode == 'webhook':
+        asyncio.run(run_webhook(application, set_webhook=not args.no_set_webhook))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+# Порт для отдельного эндпоинта /metrics в режиме polling (в режиме webhook метрики
+# отдаёт webhook-сервер); пусто — не запускать
+METRICS_PORT = os.getenv("METRICS_PORT", "")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: запись — один bisect и два сложения"""
+
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+
+class Metrics:
+    """Счётчики вызовов, ошибок и гистограммы задержек по именам операций"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def observe(self, name: str, seconds: float, error: bool = False) -> None:
+        self.calls[name] += 1
+        if error:
+            self.errors[name] += 1
+        self.latency[name].observe(seconds)
+
+    def inc(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def timed(self, name: str, ignore: Tuple[Type[BaseException], ...] = ()):
+        """Декоратор: считает вызовы, ошибки и время выполнения функции или корутины.
+
+        Исключения из ignore ошибками не считаются (например, ApplicationHandlerStop).
+        """
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except ignore:
+                        self.observe(name, time.perf_counter() - started)
+                        raise
+                    except Exception:
+                        self.observe(name, time.perf_counter() - started, error=True)
+                        raise
+                    self.observe(name, time.perf_counter() - started)
+                    return result
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except ignore:
+                    self.observe(name, time.perf_counter() - started)
+                    raise
+                except Exception:
+                    self.observe(name, time.perf_counter() - started, error=True)
+                    raise
+                self.observe(name, time.perf_counter() - started)
+                return result
+            return wrapper
+        return decorator
+
+    def render_text(self, prefix: Optional[str] = None) -> List[str]:
+        """Строки для /stats: вызовы, ошибки и p50/p95/p99 в миллисекундах"""
+        lines = []
+        names = [n for n in self.calls if prefix is None or n.startswith(prefix)]
+        for name in sorted(names, key=lambda n: -self.calls[n]):
+            h = self.latency[name]
+            short_name = name[len(prefix):] if prefix else name
+            lines.append(
+                f"{short_name}: {self.calls[name]} выз., {self.errors[name]} ош., "
+                f"p50 {h.quantile(0.5) * 1000:g} мс, p95 {h.quantile(0.95) * 1000:g} мс, "
+                f"p99 {h.quantile(0.99) * 1000:g} мс"
+            )
+        return lines
+
+    def render_prometheus(self) -> List[str]:
+        """Метрики в текстовом формате Prometheus"""
+        lines = [
+            "# TYPE jeeptour_calls_total counter",
+            *(f'jeeptour_calls_total{{op="{n}"}} {v}' for n, v in sorted(self.calls.items())),
+            "# TYPE jeeptour_errors_total counter",
+            *(f'jeeptour_errors_total{{op="{n}"}} {v}' for n, v in sorted(self.errors.items())),
+            "# TYPE jeeptour_latency_seconds histogram",
+        ]
+        for name, h in sorted(self.latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), h.counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else f"{bound:g}"
+                lines.append(f'jeeptour_latency_seconds_bucket{{op="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'jeeptour_latency_seconds_sum{{op="{name}"}} {h.total}')
+            lines.append(f'jeeptour_latency_seconds_count{{op="{name}"}} {h.count}')
+        for name, value in sorted(self.counters.items()):
+            metric = "jeeptour_" + name.replace('.', '_')
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        return lines
+
+
+metrics = Metrics()
+
+
+def instrument_handler(handler) -> None:
+    """Оборачивает callback обработчика (и вложенных обработчиков диалога) замером времени"""
+    from telegram.ext import ApplicationHandlerStop, ConversationHandler
+    if isinstance(handler, ConversationHandler):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested += state_handlers
+        for h in nested:
+            instrument_handler(h)
+        return
+    callback = handler.callback
+    if getattr(callback, '_instrumented', False):
+        return
+    name = getattr(callback, '__name__', type(callback).__name__)
+    wrapped = metrics.timed(f"handler.{name}", ignore=(ApplicationHandlerStop,))(callback)
+    wrapped._instrumented = True
+    handler.callback = wrapped
+
+
+def instrument_application(application) -> None:
+    """Включает замеры для всех обработчиков приложения"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler)
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 10)
+        while (await asyncio.wait_for(reader.readline(), 10)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b'GET' and parts[1] == b'/metrics':
+            status, body = "200 OK", ("\n".join(metrics.render_prometheus()) + "\n").encode('utf-8')
+        else:
+            status, body = "404 Not Found", b''
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: str = METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """Запускает эндпоинт GET /metrics, если задан METRICS_PORT"""
+    if not port:
+        return None
+    server = await asyncio.start_server(_serve_metrics, host, int(port), limit=16 * 1024)
+    logger.info("Метрики Prometheus: http://%s:%s/metrics", host, port)
+    return server
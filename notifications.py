@@ -0,0 +1,509 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_FILE = os.getenv("NOTIFY_OUTBOX_FILE", "outbox.db")
+# Ограничения Telegram: около 30 сообщений в секунду всего и 1 в секунду в один чат
+GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+PER_CHAT_RATE = float(os.getenv("NOTIFY_PER_CHAT_RATE", "1"))
+CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+# Сводка новых бронирований для админов: окно тишины, после которого сводка уходит
+# (0 — отправлять каждое бронирование отдельно), предельная задержка и размер пачки
+DIGEST_WINDOW = float(os.getenv("NOTIFY_DIGEST_WINDOW", "0"))
+DIGEST_MAX_DELAY = float(os.getenv("NOTIFY_DIGEST_MAX_DELAY", "60"))
+DIGEST_MAX_ITEMS = int(os.getenv("NOTIFY_DIGEST_MAX_ITEMS", "30"))
+# Несколько процессов с одним outbox: отправляет только ведущий, удерживающий аренду.
+# Срок аренды, с; ведущий продлевает её втрое чаще, и как часто он забирает новые сообщения
+LEASE_TTL = float(os.getenv("NOTIFY_LEASE_TTL", "30"))
+POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "1"))
+MESSAGE_LIMIT = 4000
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def is_idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class Outbox:
+    """Очередь неотправленных сообщений в SQLite: переживает перезапуск бота"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL
+            )
+        """)
+        # Бронирования, ждущие сводки: переживают сбой до её отправки
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS digest (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                booking TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS lease (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+
+    def put(self, chat_id: int, text: str) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (chat_id, text, next_attempt) VALUES (?, ?, ?)",
+                (chat_id, text, time.time())
+            )
+        return cursor.lastrowid
+
+    def put_many(self, messages: List[Tuple[int, str]], digest_ids: List[int] = ()) -> List[int]:
+        """Сохраняет пачку сообщений (chat_id, текст) одной транзакцией и удаляет
+        вошедшие в них бронирования сводки"""
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for chat_id, text in messages:
+                    cursor = self._conn.execute(
+                        "INSERT INTO outbox (chat_id, text, next_attempt) VALUES (?, ?, ?)",
+                        (chat_id, text, now)
+                    )
+                    ids.append(cursor.lastrowid)
+                self._conn.executemany("DELETE FROM digest WHERE id = ?", [(i,) for i in digest_ids])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def pending(self, after_id: int = 0) -> List[Tuple[int, int, str, int, float]]:
+        """Неотправленные сообщения с id больше after_id. Писатели SQLite выстроены в очередь,
+        поэтому сообщение с меньшим id не может появиться позже прочитанного."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, chat_id, text, attempts, next_attempt FROM outbox WHERE id > ? ORDER BY id",
+                (after_id,)
+            ).fetchall()
+
+    def add_digest(self, chat_id: int, booking: Dict) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO digest (chat_id, booking, created) VALUES (?, ?, ?)",
+                (chat_id, json.dumps(booking, ensure_ascii=False), time.time())
+            )
+        return cursor.lastrowid
+
+    def stale_digest(self, before: float) -> List[Tuple[int, int, Dict]]:
+        """Бронирования сводки, сохранённые раньше before: (id, chat_id, бронирование)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, chat_id, booking FROM digest WHERE created < ? ORDER BY id", (before,)
+            ).fetchall()
+        return [(row_id, chat_id, json.loads(booking)) for row_id, chat_id, booking in rows]
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Берёт или продлевает аренду, если она свободна, истекла или уже принадлежит owner"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO lease (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE lease.owner = excluded.owner OR lease.expires < ?",
+                (name, owner, now + ttl, now)
+            )
+            row = self._conn.execute("SELECT owner FROM lease WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name: str, owner: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM lease WHERE name = ? AND owner = ?", (name, owner))
+
+    def done(self, message_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+    def reschedule(self, message_id: int, attempts: int, next_attempt: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+                (attempts, next_attempt, message_id)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class Notifier:
+    """Фоновая отправка уведомлений через outbox.
+
+    enqueue() сохраняет сообщение и сразу возвращает управление. Фоновая задача
+    отправляет сообщения параллельно с учётом общего и поканального лимита и
+    повторяет неудачные попытки с экспоненциальной задержкой.
+
+    Если outbox общий для нескольких процессов, сообщения отправляет только один —
+    ведущий, удерживающий аренду в outbox. Он же забирает сообщения, сохранённые
+    другими процессами; остальные процессы только пишут в outbox.
+    """
+
+    def __init__(self, outbox_file: str = OUTBOX_FILE):
+        self.outbox_file = outbox_file
+        self._outbox: Optional[Outbox] = None
+        self._bot = None
+        # Очередь (время следующей попытки, id, chat_id, текст, число попыток)
+        self._queue: List[Tuple[float, int, int, str, int]] = []
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._deliveries = set()
+        self._global_bucket = TokenBucket(GLOBAL_RATE, capacity=GLOBAL_RATE)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._slots = asyncio.Semaphore(CONCURRENCY)
+        # Аренда роли ведущего и последний id outbox, уже взятый в очередь
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.is_leader = False
+        self._renew_at = 0.0
+        self._last_id = 0
+
+    async def start(self, bot) -> None:
+        """Берёт аренду, загружает неотправленные сообщения и запускает фоновую отправку"""
+        self._bot = bot
+        self._outbox = await asyncio.to_thread(Outbox, self.outbox_file)
+        await self._renew()
+        self._worker = asyncio.create_task(self._run())
+
+    async def _renew(self) -> None:
+        """Продлевает аренду; при смене роли загружает или забывает очередь"""
+        leader = await asyncio.to_thread(self._outbox.acquire_lease, 'notifier', self._owner, LEASE_TTL)
+        self._renew_at = time.monotonic() + LEASE_TTL / 3
+        if leader and not self.is_leader:
+            self._queue, self._last_id = [], 0
+            await self._poll()
+            logger.info("Процесс отправляет уведомления, в outbox неотправленных: %d", len(self._queue))
+        elif not leader and self.is_leader:
+            # Очередь перешла к другому процессу, начатые отправки завершаются
+            logger.warning("Аренда отправки уведомлений перешла к другому процессу")
+            self._queue = []
+        self.is_leader = leader
+
+    async def _poll(self) -> None:
+        """Забирает в очередь сообщения, сохранённые в outbox после прошлого раза"""
+        for message_id, chat_id, text, attempts, next_attempt in await asyncio.to_thread(
+                self._outbox.pending, self._last_id):
+            heapq.heappush(self._queue, (next_attempt, message_id, chat_id, text, attempts))
+            self._last_id = message_id
+
+    async def stop(self) -> None:
+        """Останавливает отправку; неотправленное остаётся в outbox до следующего запуска"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._deliveries:
+            await asyncio.wait(self._deliveries, timeout=10)
+        if self._outbox is not None:
+            if self.is_leader:
+                # Другой процесс сможет сразу взять отправку, не дожидаясь истечения аренды
+                self._outbox.release_lease('notifier', self._owner)
+                self.is_leader = False
+            self._outbox.close()
+            self._outbox = None
+
+    async def enqueue(self, chat_id: int, text: str) -> None:
+        """Ставит сообщение в очередь на отправку"""
+        await asyncio.to_thread(self._outbox.put, chat_id, text)
+        # Ведущий заберёт сообщение из outbox вместе с сообщениями других процессов
+        self._wakeup.set()
+
+    async def enqueue_many(self, messages: List[Tuple[int, str]], digest_ids: List[int] = ()) -> None:
+        """Ставит в очередь пачку сообщений (chat_id, текст) одной записью в outbox;
+        digest_ids — сохранённые бронирования сводки, которые эти сообщения заменяют"""
+        if not messages and not digest_ids:
+            return
+        await asyncio.to_thread(self._outbox.put_many, messages, digest_ids)
+        self._wakeup.set()
+
+    async def save_digest_item(self, chat_id: int, booking: Dict) -> int:
+        return await asyncio.to_thread(self._outbox.add_digest, chat_id, booking)
+
+    async def stale_digest_items(self, before: float) -> List[Tuple[int, int, Dict]]:
+        return await asyncio.to_thread(self._outbox.stale_digest, before)
+
+    @property
+    def pending(self) -> int:
+        """Число сообщений, ожидающих отправки"""
+        return len(self._queue) + len(self._deliveries)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 1000:
+                # Забываем чаты, которые уже восстановили полный лимит
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.is_idle()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(PER_CHAT_RATE)
+        return bucket
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if time.monotonic() >= self._renew_at:
+                await self._renew()
+            if not self.is_leader:
+                await asyncio.sleep(max(0.0, self._renew_at - time.monotonic()))
+                continue
+            await self._poll()
+            now = time.time()
+            while self._queue and self._queue[0][0] <= now:
+                item = heapq.heappop(self._queue)
+                bucket = self._chat_bucket(item[2])
+                if not bucket.try_acquire():
+                    # Лимит этого чата исчерпан — откладываем, не занимая слот отправки
+                    heapq.heappush(self._queue, (now + 1 / bucket.rate,) + item[1:])
+                    continue
+                await self._slots.acquire()
+                task = asyncio.create_task(self._deliver(*item[1:]))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+            # Не реже POLL_INTERVAL проверяем outbox на сообщения других процессов
+            timeout = min(POLL_INTERVAL, self._renew_at - time.monotonic())
+            if self._queue:
+                timeout = min(timeout, self._queue[0][0] - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, message_id: int, chat_id: int, text: str, attempts: int) -> None:
+        try:
+            await self._global_bucket.acquire()
+            started = time.perf_counter()
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text)
+                metrics.observe('notify.send', time.perf_counter() - started)
+            except RetryAfter as e:
+                metrics.observe('notify.send', time.perf_counter() - started, error=True)
+                await self._retry(message_id, chat_id, text, attempts, float(e.retry_after))
+            except (Forbidden, BadRequest) as e:
+                metrics.observe('notify.send', time.perf_counter() - started, error=True)
+                # Повторять бессмысленно: бот заблокирован или чат не существует
+                logger.error("Уведомление в чат %s не доставлено: %s\n%s", chat_id, e, text)
+                await asyncio.to_thread(self._outbox.done, message_id)
+            except Exception as e:
+                metrics.observe('notify.send', time.perf_counter() - started, error=True)
+                delay = min(BACKOFF_MAX, BACKOFF_BASE ** attempts)
+                logger.warning("Ошибка отправки в чат %s (попытка %d): %s", chat_id, attempts + 1, e)
+                await self._retry(message_id, chat_id, text, attempts, delay)
+            else:
+                await asyncio.to_thread(self._outbox.done, message_id)
+        finally:
+            self._slots.release()
+
+    async def _retry(self, message_id: int, chat_id: int, text: str, attempts: int, delay: float) -> None:
+        attempts += 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.error("Уведомление в чат %s отброшено после %d попыток:\n%s", chat_id, attempts, text)
+            await asyncio.to_thread(self._outbox.done, message_id)
+            return
+        next_attempt = time.time() + delay
+        await asyncio.to_thread(self._outbox.reschedule, message_id, attempts, next_attempt)
+        heapq.heappush(self._queue, (next_attempt, message_id, chat_id, text, attempts))
+        self._wakeup.set()
+
+
+class BookingDigest:
+    """Собирает новые бронирования в одну сводку на каждый чат админа.
+
+    Сводка уходит, когда DIGEST_WINDOW секунд не было новых бронирований, но не
+    позже DIGEST_MAX_DELAY секунд после первого из них, или сразу, как только
+    накопилось DIGEST_MAX_ITEMS бронирований. Бронирования группируются по
+    локации и дате.
+
+    Каждое бронирование сразу сохраняется в outbox и удаляется оттуда вместе с
+    записью сводки. Записи, которые живой процесс уже отправил бы, а они остались
+    (процесс упал), ведущий процесс отправляет сводкой сам.
+    """
+
+    def __init__(self, notifier: 'Notifier', window: float = DIGEST_WINDOW,
+                 max_delay: float = DIGEST_MAX_DELAY, max_items: int = DIGEST_MAX_ITEMS):
+        self.notifier = notifier
+        self.window = window
+        self.max_delay = max_delay
+        self.max_items = max_items
+        # Чат -> [(id записи в outbox, бронирование)]
+        self._buffers: Dict[int, List[Tuple[int, Dict]]] = {}
+        self._first_at: Dict[int, float] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._flushes = set()
+        self._recovery: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def start(self) -> None:
+        """Запускает отправку сводок, оставшихся после сбоя"""
+        self._recovery = asyncio.create_task(self._recover_periodically())
+
+    async def stop(self) -> None:
+        if self._recovery is not None:
+            self._recovery.cancel()
+            try:
+                await self._recovery
+            except asyncio.CancelledError:
+                pass
+            self._recovery = None
+
+    async def _recover_periodically(self) -> None:
+        while True:
+            try:
+                await self.recover()
+            except Exception:
+                logger.exception("Не удалось отправить оставшиеся сводки")
+            await asyncio.sleep(max(self.max_delay, LEASE_TTL))
+
+    async def recover(self) -> None:
+        """Отправляет сохранённые бронирования, которые живой процесс давно отправил бы"""
+        if not self.notifier.is_leader:
+            return
+        # Живой процесс отправляет сводку не позже max_delay; запас на смену ведущего
+        items = await self.notifier.stale_digest_items(time.time() - self.max_delay - LEASE_TTL)
+        by_chat: Dict[int, List[Tuple[int, Dict]]] = {}
+        for row_id, chat_id, booking in items:
+            by_chat.setdefault(chat_id, []).append((row_id, booking))
+        for chat_id, chat_items in by_chat.items():
+            logger.info("Отправляется сводка, оставшаяся после сбоя: чат %s, бронирований %d",
+                        chat_id, len(chat_items))
+            await self._send(chat_id, chat_items)
+
+    async def _send(self, chat_id: int, items: List[Tuple[int, Dict]]) -> None:
+        messages = [(chat_id, text) for text in self.render([booking for _, booking in items])]
+        await self.notifier.enqueue_many(messages, [row_id for row_id, _ in items])
+
+    async def add(self, chat_id: int, booking: Dict) -> None:
+        row_id = await self.notifier.save_digest_item(chat_id, booking)
+        buffer = self._buffers.setdefault(chat_id, [])
+        buffer.append((row_id, booking))
+        now = time.monotonic()
+        first_at = self._first_at.setdefault(chat_id, now)
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        if len(buffer) >= self.max_items:
+            await self.flush(chat_id)
+            return
+        delay = max(0.0, min(self.window, first_at + self.max_delay - now))
+        self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._flush_later, chat_id)
+
+    def _flush_later(self, chat_id: int) -> None:
+        task = asyncio.create_task(self.flush(chat_id))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self, chat_id: int) -> None:
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._first_at.pop(chat_id, None)
+        items = self._buffers.pop(chat_id, None)
+        if items:
+            await self._send(chat_id, items)
+
+    async def flush_all(self) -> None:
+        """Отправляет всё накопленное (при остановке бота)"""
+        if self._flushes:
+            await asyncio.wait(self._flushes)
+        for chat_id in list(self._buffers):
+            await self.flush(chat_id)
+
+    @staticmethod
+    def render(bookings: List[Dict]) -> List[str]:
+        """Текст сводки; длинная сводка делится на несколько сообщений"""
+        groups: Dict[Tuple[str, str], List[Dict]] = {}
+        for b in bookings:
+            groups.setdefault((b.get('location'), b.get('date')), []).append(b)
+        lines = [f"🚗 НОВЫЕ БРОНИРОВАНИЯ ДЖИП-ТУРОВ: {len(bookings)}"]
+        for (location, date), group in groups.items():
+            people = sum(int(b.get('people') or 0) for b in group)
+            lines.append(f"\n📍 {location} — {date} (человек: {people})")
+            lines += [
+                f"#{b['id']} {b.get('time')}, {b.get('people')} чел., @{b.get('username')} ({b.get('first_name')})"
+                for b in sorted(group, key=lambda b: (b.get('time') or '', b['id']))
+            ]
+        messages, current = [], ""
+        for line in lines:
+            if current and len(current) + len(line) + 1 > MESSAGE_LIMIT:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+        messages.append(current)
+        return messages
+
+
+notifier = Notifier()
+digest = BookingDigest(notifier)
+
+
+async def notify_admins(admin_chat_ids: List[int], text: str) -> None:
+    """Ставит уведомление в очередь для каждого администратора"""
+    await notifier.enqueue_many([(admin_id, text) for admin_id in admin_chat_ids])
+
+
+async def notify_admins_booking(admin_chat_ids: List[int], booking: Dict, text: str) -> None:
+    """Уведомляет админов о новом бронировании: сразу или в сводке, если она включена"""
+    if not digest.enabled:
+        await notify_admins(admin_chat_ids, text)
+        return
+    for admin_id in admin_chat_ids:
+        await digest.add(admin_id, booking)
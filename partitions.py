@@ -0,0 +1,240 @@
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import List, Dict, Any, Iterator, Optional
+from storage import BookingStorage, JsonFileStorage, write_atomic
+from metrics import metrics
+
+# Раздел для бронирований без корректной даты тура
+UNDATED = "undated"
+
+
+def partition_key(date: Optional[str]) -> str:
+    """Раздел по дате тура: 20.07.2025 -> 2025-07"""
+    try:
+        day, month, year = date.split('.')
+        return f"{int(year):04d}-{int(month):02d}"
+    except (AttributeError, ValueError):
+        return UNDATED
+
+
+class PartitionedStorage(BookingStorage):
+    """Хранилище, разбитое на разделы по месяцу тура.
+
+    Текущие и будущие месяцы лежат в отдельных JSON-файлах и держатся в памяти,
+    изменение перезаписывает только файл своего месяца. Прошедшие месяцы
+    переносятся archive() в сжатый архив (archive/ГГГГ-ММ.json.gz), который
+    только читается и открывается по запросу.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # Разделы и meta.json, изменённые с последней записи на диск
+        self._dirty = set()
+        self.archive_dir = os.path.join(directory, 'archive')
+        self.meta_file = os.path.join(directory, 'meta.json')
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self._partitions: Optional[Dict[str, Dict[int, Dict[str, Any]]]] = None
+        self._id_partition: Dict[int, str] = {}
+        self._meta = self._read_json(self.meta_file, {})
+
+    # --- Файлы ---
+
+    @staticmethod
+    def _read_json(path: str, default):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                metrics.inc('storage.bytes_read', os.fstat(f.fileno()).st_size)
+                return json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return default
+
+    @staticmethod
+    def _write_json(path: str, data) -> None:
+        write_atomic(path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def _partition_file(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _archive_file(self, key: str) -> str:
+        return os.path.join(self.archive_dir, f"{key}.json.gz")
+
+    def _read_archive(self, key: str) -> List[Dict[str, Any]]:
+        path = self._archive_file(key)
+        if not os.path.exists(path):
+            return []
+        metrics.inc('storage.bytes_read', os.path.getsize(path))
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_archive(self, key: str, bookings: List[Dict[str, Any]]) -> None:
+        data = json.dumps(bookings, ensure_ascii=False).encode('utf-8')
+        write_atomic(self._archive_file(key), gzip.compress(data))
+
+    def _write_partition(self, key: str) -> None:
+        bookings = self._partitions.get(key)
+        if bookings:
+            self._write_json(self._partition_file(key), list(bookings.values()))
+        else:
+            self._partitions.pop(key, None)
+            if os.path.exists(self._partition_file(key)):
+                os.remove(self._partition_file(key))
+
+    def _save_partition(self, key: str) -> None:
+        self._dirty.add(key)
+        if self.autoflush:
+            self.flush()
+
+    def _save_meta(self) -> None:
+        self._dirty.add(None)
+        if self.autoflush:
+            self.flush()
+
+    def flush(self) -> None:
+        """Записывает изменённые разделы; meta.json с last_id — первым, чтобы ID не повторились"""
+        # Отметка снимается только после записи: при ошибке раздел запишется в следующий раз
+        if None in self._dirty:
+            self._write_json(self.meta_file, self._meta)
+            self._dirty.discard(None)
+        for key in sorted(k for k in self._dirty if k is not None):
+            self._write_partition(key)
+            self._dirty.discard(key)
+
+    def close(self) -> None:
+        self.flush()
+
+    # --- Загрузка ---
+
+    def _ensure_loaded(self) -> Dict[str, Dict[int, Dict[str, Any]]]:
+        if self._partitions is None:
+            partitions = {}
+            for name in os.listdir(self.directory):
+                if name.endswith('.json') and name != 'meta.json':
+                    key = name[:-len('.json')]
+                    data = self._read_json(os.path.join(self.directory, name), [])
+                    partitions[key] = {b['id']: b for b in data if 'id' in b}
+            self._partitions = partitions
+            self._id_partition = {i: key for key, bookings in partitions.items() for i in bookings}
+            last_id = max(self._id_partition, default=0)
+            if last_id > self._meta.get('last_id', 0):
+                self._meta['last_id'] = last_id
+        return self._partitions
+
+    def migrate_from_json(self, json_file: str) -> int:
+        """Однократно раскладывает bookings.json по разделам. Возвращает число записей."""
+        if self._meta.get('migrated_from'):
+            return 0
+        bookings = JsonFileStorage(json_file).all()
+        partitions = self._ensure_loaded()
+        for booking in bookings:
+            if 'id' not in booking:
+                continue
+            key = partition_key(booking.get('date'))
+            partitions.setdefault(key, {})[booking['id']] = booking
+            self._id_partition[booking['id']] = key
+        for key in {partition_key(b.get('date')) for b in bookings}:
+            self._save_partition(key)
+        self._meta['last_id'] = max([self._meta.get('last_id', 0)] + list(self._id_partition))
+        self._meta['migrated_from'] = json_file
+        self._save_meta()
+        return len(bookings)
+
+    # --- Операции ---
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Бронирования оперативных разделов (без архива)"""
+        return [b for bookings in self._ensure_loaded().values() for b in bookings.values()]
+
+    def get(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        key = self._id_partition.get(booking_id) if self._partitions is not None else None
+        if key is None:
+            self._ensure_loaded()
+            key = self._id_partition.get(booking_id)
+        return self._partitions[key].get(booking_id) if key is not None else None
+
+    def by_date(self, date: str) -> List[Dict[str, Any]]:
+        key = partition_key(date)
+        bookings = self._ensure_loaded().get(key)
+        source = bookings.values() if bookings is not None else self._read_archive(key)
+        return [b for b in source if b.get('date') == date]
+
+    def add(self, booking: Dict[str, Any]) -> Dict[str, Any]:
+        partitions = self._ensure_loaded()
+        self._meta['last_id'] = self._meta.get('last_id', 0) + 1
+        booking['id'] = self._meta['last_id']
+        key = partition_key(booking.get('date'))
+        partitions.setdefault(key, {})[booking['id']] = booking
+        self._id_partition[booking['id']] = key
+        self._save_meta()
+        self._save_partition(key)
+        return booking
+
+    def update_status(self, booking_id: int, status: str) -> bool:
+        # Архивные бронирования только читаются
+        booking = self.get(booking_id)
+        if booking is None:
+            return False
+        booking['status'] = status
+        self._save_partition(self._id_partition[booking_id])
+        return True
+
+    def delete(self, booking_id: int) -> bool:
+        self._ensure_loaded()
+        key = self._id_partition.pop(booking_id, None)
+        if key is None:
+            return False
+        del self._partitions[key][booking_id]
+        self._save_partition(key)
+        return True
+
+    def replace_all(self, bookings: List[Dict[str, Any]]) -> None:
+        old_keys = set(self._ensure_loaded())
+        for name in os.listdir(self.archive_dir):
+            os.remove(os.path.join(self.archive_dir, name))
+        self._partitions = {}
+        self._id_partition = {}
+        for booking in bookings:
+            if 'id' in booking:
+                key = partition_key(booking.get('date'))
+                self._partitions.setdefault(key, {})[booking['id']] = booking
+                self._id_partition[booking['id']] = key
+        for key in old_keys | set(self._partitions):
+            self._save_partition(key)
+        self._meta['last_id'] = max([self._meta.get('last_id', 0)] + list(self._id_partition))
+        self._save_meta()
+        # Архив уже удалён, поэтому разделы записываем сразу
+        self.flush()
+
+    # --- Архив ---
+
+    def archive(self, before: datetime) -> List[int]:
+        """Переносит в архив разделы месяцев раньше before. Возвращает ID перенесённых бронирований."""
+        limit = f"{before.year:04d}-{before.month:02d}"
+        archived = []
+        partitions = self._ensure_loaded()
+        for key in sorted(k for k in partitions if k != UNDATED and k < limit):
+            bookings = partitions[key]
+            # Если месяц уже архивировался, дописываем к нему
+            self._write_archive(key, self._read_archive(key) + list(bookings.values()))
+            for booking_id in bookings:
+                self._id_partition.pop(booking_id, None)
+            archived += bookings
+            bookings.clear()
+            self._dirty.add(key)
+        # Перенесённые в архив записи сразу убираем из разделов, не дожидаясь групповой записи
+        self.flush()
+        return archived
+
+    def archived_by_date(self, date: str) -> List[Dict[str, Any]]:
+        return [b for b in self._read_archive(partition_key(date)) if b.get('date') == date]
+
+    def iter_archived(self, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+        """Архивные бронирования по месяцам; в памяти одновременно только один месяц"""
+        first = f"{start.year:04d}-{start.month:02d}" if start else None
+        last = f"{end.year:04d}-{end.month:02d}" if end else None
+        keys = sorted(name[:-len('.json.gz')] for name in os.listdir(self.archive_dir) if name.endswith('.json.gz'))
+        for key in keys:
+            if (first is None or key >= first) and (last is None or key <= last):
+                yield from self._read_archive(key)
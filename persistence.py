@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+from telegram.ext import BasePersistence, PersistenceInput
+
+PERSISTENCE_FILE = os.getenv("PERSISTENCE_FILE", "bot_state.db")
+# Как часто Application передаёт изменённые данные в хранилище (секунды)
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "2"))
+# Задержка перед записью: все изменения одного цикла уходят одной транзакцией
+FLUSH_DELAY = 0.05
+
+
+class SqliteStateStore:
+    """Таблицы состояния бота в SQLite: данные пользователей, чатов, бота и диалогов"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        );
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def load(self, table: str, row_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT data FROM {table} WHERE id = ?", (row_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_conversations(self, name: str) -> Dict[Tuple, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    def write(self, rows: Dict[Tuple, Optional[str]], conversations: Dict[Tuple, Optional[str]]) -> None:
+        """Записывает накопленные изменения одной транзакцией; None означает удаление"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for (table, row_id), data in rows.items():
+                    if data is None:
+                        self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+                    else:
+                        self._conn.execute(
+                            f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)", (row_id, data)
+                        )
+                for (name, key), state in conversations.items():
+                    if state is None:
+                        self._conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                            (name, key, state)
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SqlitePersistence(BasePersistence):
+    """Сохраняет состояние диалогов и context.user_data между перезапусками бота.
+
+    Изменения копятся в памяти и записываются пачкой. Данные пользователя
+    читаются из базы только при первом его обновлении после запуска.
+    """
+
+    def __init__(self, path: str = PERSISTENCE_FILE, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._store = SqliteStateStore(path)
+        # Ожидающие записи: (таблица, id) -> JSON или None для удаления
+        self._pending_rows: Dict[Tuple[str, int], Optional[str]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._loaded: Set[Tuple[str, int]] = set()
+
+    # --- Ленивая загрузка ---
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Данные пользователей подгружаются в refresh_user_data по мере обращения
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return await asyncio.to_thread(self._store.load, 'bot_data', 0) or {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        return await asyncio.to_thread(self._store.load_conversations, name)
+
+    async def _refresh(self, table: str, row_id: int, data: Dict) -> None:
+        if (table, row_id) in self._loaded:
+            return
+        self._loaded.add((table, row_id))
+        stored = await asyncio.to_thread(self._store.load, table, row_id)
+        if stored and not data:
+            data.update(stored)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        await self._refresh('user_data', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        await self._refresh('chat_data', chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    # --- Накопление изменений ---
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(FLUSH_DELAY)
+        await self._write_pending()
+
+    async def _write_pending(self) -> None:
+        while self._pending_rows or self._pending_conversations:
+            rows, self._pending_rows = self._pending_rows, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            await asyncio.to_thread(self._store.write, rows, conversations)
+
+    def _put_row(self, table: str, row_id: int, data: Optional[Dict]) -> None:
+        self._loaded.add((table, row_id))
+        self._pending_rows[(table, row_id)] = None if data is None else json.dumps(data, ensure_ascii=False)
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        self._put_row('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        self._put_row('chat_data', chat_id, data)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        self._put_row('bot_data', 0, data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._put_row('user_data', user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._put_row('chat_data', chat_id, None)
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._pending_conversations[(name, json.dumps(list(key)))] = (
+            None if new_state is None else json.dumps(new_state)
+        )
+        self._schedule_flush()
+
+    async def flush(self) -> None:
+        """Записывает всё накопленное при остановке бота"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
+        self._store.close()
@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+import async_bookings
+from bookings import ACTIVE_STATUSES, departure_at
+from notifications import notifier, LEASE_TTL
+
+logger = logging.getLogger(__name__)
+
+# За сколько часов до отправления напоминать клиенту; 0 — не напоминать
+REMINDER_HOURS_BEFORE = float(os.getenv("REMINDER_HOURS_BEFORE", "12"))
+# Во сколько отправлять админам список туров на сегодня; пусто — не отправлять
+MANIFEST_TIME = os.getenv("MANIFEST_TIME", "07:00")
+# Сколько напоминаний ставится в очередь уведомлений за один раз
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "100"))
+REMINDERS_STATE_FILE = os.getenv("REMINDERS_STATE_FILE", "reminders.json")
+# Как часто перестраивать очередь, если бронирования добавляют и другие процессы, мин
+REMINDER_RESYNC_MINUTES = float(os.getenv("REMINDER_RESYNC_MINUTES", "5"))
+
+# Виды событий; порядок важен при совпадении времени
+REMINDER, MANIFEST = 0, 1
+MESSAGE_LIMIT = 4000
+
+
+class ReminderScheduler:
+    """Напоминания клиентам и утренний список туров для админов.
+
+    Все события лежат в одной куче (время, вид, ключ), одна фоновая задача спит до
+    ближайшего. Удалённые и перенесённые напоминания не вынимаются из кучи, а
+    пропускаются при срабатывании. Отметка последнего отправленного события
+    сохраняется в файл, поэтому после перезапуска ничего не повторяется, а
+    пропущенное за время простоя отправляется.
+    """
+
+    def __init__(self, admin_chat_ids: List[int], state_file: str = REMINDERS_STATE_FILE):
+        self.admin_chat_ids = admin_chat_ids
+        self.state_file = state_file
+        self._heap: List[Tuple[float, int, object]] = []
+        # ID бронирования -> время напоминания, которое сейчас действительно
+        self._scheduled: Dict[int, float] = {}
+        self._sent_until: Optional[Tuple[float, int, object]] = None
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        # Куча построена этим процессом как ведущим (см. Notifier); когда перестроить снова
+        self._active = False
+        self._resync_at: Optional[float] = None
+
+    # --- Состояние ---
+
+    def _load_state(self) -> None:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self._sent_until = tuple(json.load(f)['sent_until'])
+        except (OSError, ValueError, KeyError, TypeError):
+            self._sent_until = None
+
+    def _save_state(self) -> None:
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'sent_until': list(self._sent_until)}, f)
+        os.replace(tmp_file, self.state_file)
+
+    def _already_sent(self, event: Tuple[float, int, object]) -> bool:
+        return self._sent_until is not None and event <= self._sent_until
+
+    # --- Планирование ---
+
+    def _push(self, event: Tuple[float, int, object]) -> None:
+        was_next = not self._heap or event < self._heap[0]
+        heapq.heappush(self._heap, event)
+        if was_next:
+            self._wakeup.set()
+
+    def _reminder_event(self, booking, now: datetime, catch_up: bool) -> Optional[Tuple[float, int, object]]:
+        """Событие напоминания для бронирования; None, если напоминать не нужно или уже напомнили"""
+        if not REMINDER_HOURS_BEFORE or booking.get('status') not in ACTIVE_STATUSES:
+            return None
+        departure = departure_at(booking)
+        if departure is None:
+            return None
+        due = departure - timedelta(hours=REMINDER_HOURS_BEFORE)
+        if departure <= now or (due <= now and not catch_up):
+            return None
+        event = (due.timestamp(), REMINDER, booking['id'])
+        return None if self._already_sent(event) else event
+
+    def schedule(self, booking, catch_up: bool = False) -> None:
+        """Планирует напоминание. Без catch_up прошедшее время напоминания пропускается:
+        клиент, забронировавший тур за час до выезда, напоминание не получает."""
+        if not self._active:
+            return
+        event = self._reminder_event(booking, datetime.now(), catch_up)
+        if event is None or self._scheduled.get(booking['id']) == event[0]:
+            return  # не нужно, уже отправлено или уже запланировано на это время
+        self._scheduled[booking['id']] = event[0]
+        self._push(event)
+
+    def unschedule(self, booking_id: int) -> None:
+        self._scheduled.pop(booking_id, None)
+
+    def _manifest_event(self, day: datetime) -> Optional[Tuple[float, int, object]]:
+        if not MANIFEST_TIME or not self.admin_chat_ids:
+            return None
+        hour, minute = (int(part) for part in MANIFEST_TIME.split(':'))
+        at = day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return at.timestamp(), MANIFEST, at.strftime("%d.%m.%Y")
+
+    async def rebuild(self) -> None:
+        """Строит кучу по бронированиям хранилища на сегодня и позже"""
+        self._load_state()
+        self._heap = []
+        self._scheduled = {}
+        self._active = True
+        # Прошедшие даты не перебираются, а разбор дат идёт в потоке хранилища,
+        # поэтому запуск не блокирует цикл событий даже при миллионе бронирований
+        today = datetime.now()
+        events = await async_bookings.map_bookings(
+            partial(self._reminder_event, now=today, catch_up=True), today.strftime("%d.%m.%Y")
+        )
+        # Пока события собирались, schedule() мог добавить новые бронирования
+        for event in events:
+            if event[2] not in self._scheduled:
+                self._scheduled[event[2]] = event[0]
+                self._heap.append(event)
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+        # Сегодняшний список отправляется, даже если его время прошло, пока бот был выключен
+        event = self._manifest_event(today)
+        if event is not None:
+            if self._already_sent(event):
+                event = self._manifest_event(today + timedelta(days=1))
+            self._push(event)
+        logger.info("Запланировано напоминаний: %d", len(self._scheduled))
+
+    # --- Отправка ---
+
+    async def start(self) -> None:
+        # Напоминания и список туров отправляет только процесс, ведущий отправку уведомлений,
+        # иначе при нескольких процессах клиенты и админы получали бы их несколько раз
+        if notifier.is_leader:
+            await self._activate()
+        self._worker = asyncio.create_task(self._run())
+
+    async def _activate(self) -> None:
+        await self.rebuild()
+        # Бронирования других процессов попадают в кучу при периодической перестройке
+        shared = await async_bookings.storage_shared()
+        self._resync_at = datetime.now().timestamp() + REMINDER_RESYNC_MINUTES * 60 if shared else None
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _pop_due(self) -> List[Tuple[float, int, object]]:
+        now = datetime.now().timestamp()
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < REMINDER_BATCH:
+            event = heapq.heappop(self._heap)
+            if event[1] == REMINDER and (self._scheduled.get(event[2]) != event[0] or event in due):
+                continue  # напоминание отменено, перенесено или уже взято в эту пачку
+            due.append(event)
+        return due
+
+    async def _reminder_message(self, booking_id: int) -> Optional[Tuple[int, str]]:
+        booking = await async_bookings.get_booking_by_id(booking_id)
+        if booking is None or booking.get('status') not in ACTIVE_STATUSES or not booking.get('chat_id'):
+            return None
+        return booking['chat_id'], (
+            f"⏰ Напоминаем о вашей экскурсии #{booking_id}\n\n"
+            f"Локация: {booking['location']}\n"
+            f"Дата: {booking['date']}\n"
+            f"Время: {booking['time']}\n"
+            f"Количество человек: {booking['people']}\n\n"
+            f"Ждём вас!"
+        )
+
+    async def _manifest_messages(self, date: str) -> List[Tuple[int, str]]:
+        departures: Dict[Tuple[str, str], List] = {}
+        for booking in await async_bookings.get_bookings_by_date(date):
+            if booking.get('status') in ACTIVE_STATUSES:
+                departures.setdefault((booking['time'], booking['location']), []).append(booking)
+        if not departures:
+            return []
+        lines = [f"📋 Туры на {date}"]
+        for (time_str, location), group in sorted(departures.items()):
+            people = sum(int(b.get('people') or 0) for b in group)
+            lines.append(f"\n🕗 {time_str} — {location}, человек: {people}")
+            lines += [
+                f"#{b['id']} @{b.get('username') or '-'} ({b.get('first_name') or ''}), {b.get('people')} чел."
+                for b in group
+            ]
+        # Длинный список делим на несколько сообщений
+        chunks, chunk = [], ""
+        for line in lines:
+            if chunk and len(chunk) + len(line) + 1 > MESSAGE_LIMIT:
+                chunks.append(chunk)
+                chunk = ""
+            chunk = f"{chunk}\n{line}" if chunk else line
+        chunks.append(chunk)
+        return [(admin_id, text) for text in chunks for admin_id in self.admin_chat_ids]
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not notifier.is_leader:
+                self._active = False
+                self._heap, self._scheduled = [], {}
+                await asyncio.sleep(LEASE_TTL / 3)
+                continue
+            if not self._active or (self._resync_at is not None and datetime.now().timestamp() >= self._resync_at):
+                await self._activate()
+            events = self._pop_due()
+            if events:
+                messages = []
+                for _, kind, key in events:
+                    if kind == REMINDER:
+                        message = await self._reminder_message(key)
+                        if message is not None:
+                            messages.append(message)
+                    else:
+                        messages += await self._manifest_messages(key)
+                        self._push(self._manifest_event(datetime.strptime(key, "%d.%m.%Y") + timedelta(days=1)))
+                # Лимиты Telegram соблюдает очередь уведомлений
+                await notifier.enqueue_many(messages)
+                self._sent_until = max(events)
+                await asyncio.to_thread(self._save_state)
+                # До этого момента повторное schedule() того же напоминания отсекалось по _scheduled
+                for ts, kind, key in events:
+                    if kind == REMINDER and self._scheduled.get(key) == ts:
+                        del self._scheduled[key]
+                continue
+            # Ведущий проверяет, не перешла ли роль к другому процессу
+            timeout = LEASE_TTL / 3
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - datetime.now().timestamp())
+            if self._resync_at is not None:
+                timeout = min(timeout, self._resync_at - datetime.now().timestamp())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,32 @@
+import os
+from datetime import datetime, time
+from typing import Dict, List, Tuple
+
+# Новый список экскурсий и расписание
+LOCATIONS = [
+    "Вершины Феодосии",
+    "Белая Скала",
+    "Арпатские водопады",
+    "Меганом и мысы Судака"
+]
+LOCATION_TIMES = {
+    "Вершины Феодосии": ["09:00", "13:00", "17:00"],
+    "Белая Скала": ["08:00", "14:00"],
+    "Арпатские водопады": ["08:00", "14:00"],
+    "Меганом и мысы Судака": ["08:00", "14:00"]
+}
+
+# Время отправлений, разобранное один раз: локация -> [("08:00", time(8, 0)), ...]
+PARSED_TIMES: Dict[str, List[Tuple[str, time]]] = {
+    location: [(t, datetime.strptime(t, "%H:%M").time()) for t in times]
+    for location, times in LOCATION_TIMES.items()
+}
+
+# Количество мест на одно отправление; для отдельных локаций можно задать своё
+SEATS_PER_DEPARTURE = int(os.getenv("SEATS_PER_DEPARTURE", "6"))
+LOCATION_SEATS: Dict[str, int] = {}
+
+
+def departure_capacity(location: str) -> int:
+    """Вместимость одного отправления на локацию"""
+    return LOCATION_SEATS.get(location, SEATS_PER_DEPARTURE)
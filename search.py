@@ -0,0 +1,170 @@
+from bisect import bisect_left, insort
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+Bucket = Dict[int, Dict[str, Any]]
+
+
+def date_key(date: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """20.07.2025 -> (2025, 7, 20) для сортировки; None, если дата некорректна"""
+    try:
+        day, month, year = date.split('.')
+        return int(year), int(month), int(day)
+    except (AttributeError, ValueError):
+        return None
+
+
+def name_words(name: Optional[str]) -> List[str]:
+    return name.lower().split() if name else []
+
+
+def normalize_username(username: Optional[str]) -> Optional[str]:
+    return username.lstrip('@').lower() if username else None
+
+
+class SearchIndex:
+    """Вторичные индексы для поиска бронирований администратором.
+
+    Хеш-таблицы по username и локации, отсортированный список дат для
+    диапазонов и отсортированный список слов имён для поиска по началу слова.
+    Индексы по дате, статусу и user_id берутся у основного индекса (BookingIndex).
+    Строится по основному индексу при первом поиске и дальше обновляется вместе с ним.
+    """
+
+    def __init__(self, by_date: Dict[str, Bucket], by_status: Dict[str, Bucket], by_user: Dict[Any, Bucket]):
+        self.by_date = by_date
+        self.by_status = by_status
+        self.by_user = by_user
+        self.by_username: Dict[str, Bucket] = {}
+        self.by_location: Dict[str, Bucket] = {}
+        self.by_name: Dict[str, Bucket] = {}
+        # Отсортированные различные слова имён и даты (ключ сортировки, дата)
+        self.name_list: List[str] = []
+        self.dates: List[Tuple[Tuple[int, int, int], str]] = []
+
+    @staticmethod
+    def _bucket_add(buckets: Dict[Any, Bucket], key, booking: Dict[str, Any]) -> bool:
+        """Добавляет в корзину; True, если корзина создана"""
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = {booking['id']: booking}
+            return True
+        bucket[booking['id']] = booking
+        return False
+
+    @staticmethod
+    def _bucket_remove(buckets: Dict[Any, Bucket], key, booking_id: int) -> bool:
+        """Убирает из корзины; True, если корзина опустела и удалена"""
+        bucket = buckets.get(key)
+        if bucket is None:
+            return False
+        bucket.pop(booking_id, None)
+        if bucket:
+            return False
+        del buckets[key]
+        return True
+
+    def add(self, booking: Dict[str, Any]) -> None:
+        username = normalize_username(booking.get('username'))
+        if username:
+            self._bucket_add(self.by_username, username, booking)
+        self._bucket_add(self.by_location, booking.get('location'), booking)
+        for word in set(name_words(booking.get('first_name'))):
+            if self._bucket_add(self.by_name, word, booking):
+                insort(self.name_list, word)
+        key = date_key(booking.get('date'))
+        if key is not None:
+            entry = (key, booking['date'])
+            position = bisect_left(self.dates, entry)
+            if position == len(self.dates) or self.dates[position] != entry:
+                self.dates.insert(position, entry)
+
+    def remove(self, booking: Dict[str, Any]) -> None:
+        booking_id = booking['id']
+        username = normalize_username(booking.get('username'))
+        if username:
+            self._bucket_remove(self.by_username, username, booking_id)
+        self._bucket_remove(self.by_location, booking.get('location'), booking_id)
+        for word in set(name_words(booking.get('first_name'))):
+            if self._bucket_remove(self.by_name, word, booking_id):
+                del self.name_list[bisect_left(self.name_list, word)]
+        # Основной индекс уже убрал бронирование из корзины даты
+        key = date_key(booking.get('date'))
+        if key is not None and booking.get('date') not in self.by_date:
+            position = bisect_left(self.dates, (key, booking['date']))
+            if position < len(self.dates) and self.dates[position][1] == booking['date']:
+                del self.dates[position]
+
+    def load(self, bookings) -> None:
+        for booking in bookings:
+            self.add(booking)
+
+    # --- Поиск ---
+
+    def _name_candidates(self, prefix: str) -> Iterator[Bucket]:
+        position = bisect_left(self.name_list, prefix)
+        while position < len(self.name_list) and self.name_list[position].startswith(prefix):
+            yield self.by_name[self.name_list[position]]
+            position += 1
+
+    def _date_candidates(self, start: Optional[Tuple[int, int, int]],
+                         end: Optional[Tuple[int, int, int]]) -> Iterator[Bucket]:
+        position = bisect_left(self.dates, (start,)) if start else 0
+        while position < len(self.dates) and (end is None or self.dates[position][0] <= end):
+            yield self.by_date[self.dates[position][1]]
+            position += 1
+
+    def find(self, user_id=None, username: Optional[str] = None, name: Optional[str] = None,
+             location: Optional[str] = None, status: Optional[str] = None,
+             date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Бронирования, подходящие под все заданные условия, по порядку дат тура.
+
+        Перебирается только самый узкий из индексов, остальные условия проверяются
+        по найденным записям, поэтому время зависит от числа совпадений, а не от
+        общего числа бронирований.
+        """
+        username = normalize_username(username)
+        words = name_words(name)
+        start, end = date_key(date_from), date_key(date_to)
+        candidates: List[List[Bucket]] = []
+        if user_id is not None:
+            candidates.append([self.by_user.get(user_id, {})])
+        if username:
+            candidates.append([self.by_username.get(username, {})])
+        if words:
+            candidates.append(list(self._name_candidates(words[0])))
+        if location is not None:
+            candidates.append([self.by_location.get(location, {})])
+        if status is not None:
+            candidates.append([self.by_status.get(status, {})])
+        if start or end:
+            candidates.append(list(self._date_candidates(start, end)))
+        if not candidates:
+            candidates.append(list(self._date_candidates(None, None)))
+        buckets = min(candidates, key=lambda group: sum(len(bucket) for bucket in group))
+
+        results = []
+        seen = set()
+        for bucket in buckets:
+            for booking in bucket.values():
+                if booking['id'] in seen:
+                    continue
+                seen.add(booking['id'])
+                if user_id is not None and booking.get('user_id') != user_id:
+                    continue
+                if username and normalize_username(booking.get('username')) != username:
+                    continue
+                if location is not None and booking.get('location') != location:
+                    continue
+                if status is not None and booking.get('status') != status:
+                    continue
+                if words:
+                    booking_words = name_words(booking.get('first_name'))
+                    if not all(any(w.startswith(word) for w in booking_words) for word in words):
+                        continue
+                if start or end:
+                    key = date_key(booking.get('date'))
+                    if key is None or (start and key < start) or (end and key > end):
+                        continue
+                results.append(booking)
+        results.sort(key=lambda b: (date_key(b.get('date')) or (0, 0, 0), b.get('time') or '', b['id']))
+        return results
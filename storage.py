@@ -0,0 +1,617 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Iterator, Optional, Tuple
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка процесса недоступна
+    fcntl = None
+
+
+class SlotFullError(Exception):
+    """На отправлении не хватает свободных мест"""
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Записывает файл целиком через временный файл, fsync и переименование.
+
+    После сбоя на диске остаётся либо старая, либо новая версия файла, но не обрезанная.
+    """
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    if hasattr(os, 'O_DIRECTORY'):
+        # Переименование надёжно, только когда записан и каталог
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    metrics.inc('storage.bytes_written', len(data))
+    metrics.inc('storage.fsyncs')
+
+
+class BookingStorage:
+    """Интерфейс хранилища бронирований.
+
+    Реализации обязаны поддерживать all/add/update_status/delete/replace_all.
+    Остальные запросы по умолчанию выполняются перебором all(), но реализации
+    с индексами переопределяют их.
+
+    Хранилище с shared = True могут одновременно использовать несколько процессов:
+    оно само проверяет дубликаты и места при добавлении и сообщает об изменениях,
+    сделанных другими процессами (snapshot/changes_since).
+    """
+
+    shared = False
+    # False — изменения копятся в памяти до flush() (групповая фиксация)
+    autoflush = True
+
+    def all(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def add(self, booking: Dict[str, Any]) -> Dict[str, Any]:
+        """Сохраняет бронирование, присваивая ему booking['id']"""
+        raise NotImplementedError
+
+    def update_status(self, booking_id: int, status: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, booking_id: int) -> bool:
+        raise NotImplementedError
+
+    def replace_all(self, bookings: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def update_status_many(self, booking_ids: List[int], status: str) -> List[int]:
+        """Меняет статус нескольких бронирований одной записью на диск. Возвращает ID изменённых."""
+        autoflush, self.autoflush = self.autoflush, False
+        try:
+            updated = [booking_id for booking_id in booking_ids if self.update_status(booking_id, status)]
+        finally:
+            self.autoflush = autoflush
+        if autoflush:
+            self.flush()
+        return updated
+
+    def get(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        for booking in self.all():
+            if booking.get('id') == booking_id:
+                return booking
+        return None
+
+    def by_date(self, date: str) -> List[Dict[str, Any]]:
+        return [b for b in self.all() if b.get('date') == date]
+
+    def exists(self, user_id, location, date, time) -> bool:
+        for booking in self.all():
+            if (
+                booking['user_id'] == user_id and
+                booking['location'] == location and
+                booking['date'] == date and
+                booking['time'] == time
+            ):
+                return True
+        return False
+
+    def flush(self) -> None:
+        """Надёжно записывает на диск изменения, накопленные при autoflush = False"""
+
+    def close(self) -> None:
+        pass
+
+    def snapshot(self) -> Tuple[List[Dict[str, Any]], Any]:
+        """Все бронирования и курсор для changes_since"""
+        return self.all(), None
+
+    def changes_since(self, cursor) -> Optional[Tuple[Any, Optional[Dict[int, Optional[Dict[str, Any]]]]]]:
+        """Изменения других процессов после курсора: None — изменений нет, иначе
+        (новый курсор, {id: бронирование или None, если удалено}); None вместо
+        словаря означает, что нужно перечитать всё через snapshot()."""
+        return None
+
+    def add_if_new(self, booking: Dict[str, Any], capacity: Optional[int],
+                   active_statuses: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        """Атомарно проверяет дубликат и места и добавляет бронирование (только shared)"""
+        raise NotImplementedError
+
+    def update_status_many_if_fits(self, booking_ids: List[int], status: str, capacity: Callable[[str], int],
+                                   active_statuses: Tuple[str, ...]) -> Tuple[List[int], List[int]]:
+        """Атомарно меняет статус, не возвращая в активные бронирования, для которых
+        на отправлении не хватает мест (только shared). Возвращает ID изменённых и не поместившихся."""
+        raise NotImplementedError
+
+    # Архив прошедших туров есть только у хранилища с разделами
+
+    def archive(self, before: datetime) -> List[int]:
+        """Переносит в архив бронирования на туры раньше before. Возвращает их ID."""
+        return []
+
+    def archived_by_date(self, date: str) -> List[Dict[str, Any]]:
+        return []
+
+    def iter_archived(self, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+        return iter(())
+
+
+class JsonFileStorage(BookingStorage):
+    """Хранилище в одном JSON-файле: каждая запись перезаписывает файл целиком.
+
+    Бронирования держатся в памяти; при autoflush = False несколько изменений
+    записываются на диск одной перезаписью в flush().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._bookings: Optional[List[Dict[str, Any]]] = None
+        self._last_id = 0
+        self._dirty = False
+
+    def _ensure_loaded(self) -> List[Dict[str, Any]]:
+        if self._bookings is None:
+            bookings = []
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        metrics.inc('storage.bytes_read', os.fstat(f.fileno()).st_size)
+                        bookings = json.load(f)
+                except (json.JSONDecodeError, FileNotFoundError):
+                    pass
+            self._bookings = bookings
+            self._last_id = max((b.get('id', 0) for b in bookings), default=0)
+        return self._bookings
+
+    def _changed(self) -> None:
+        self._dirty = True
+        if self.autoflush:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._dirty:
+            data = json.dumps(self._bookings, ensure_ascii=False, indent=2).encode('utf-8')
+            write_atomic(self.path, data)
+            self._dirty = False
+
+    def all(self) -> List[Dict[str, Any]]:
+        return list(self._ensure_loaded())
+
+    def replace_all(self, bookings: List[Dict[str, Any]]) -> None:
+        self._bookings = list(bookings)
+        self._last_id = max([self._last_id] + [b.get('id', 0) for b in bookings])
+        self._changed()
+
+    def add(self, booking: Dict[str, Any]) -> Dict[str, Any]:
+        bookings = self._ensure_loaded()
+        self._last_id += 1
+        booking['id'] = self._last_id
+        bookings.append(booking)
+        self._changed()
+        return booking
+
+    def update_status(self, booking_id: int, status: str) -> bool:
+        for booking in self._ensure_loaded():
+            if booking.get('id') == booking_id:
+                booking['status'] = status
+                self._changed()
+                return True
+        return False
+
+    def delete(self, booking_id: int) -> bool:
+        bookings = self._ensure_loaded()
+        new_bookings = [b for b in bookings if b.get('id') != booking_id]
+        if len(new_bookings) == len(bookings):
+            return False
+        self._bookings = new_bookings
+        self._changed()
+        return True
+
+
+class SqliteStorage(BookingStorage):
+    """Хранилище в SQLite (WAL) с индексами для проверки дубликатов и выборки по дате.
+
+    Базу могут использовать несколько процессов: запись идёт в транзакциях
+    (BEGIN IMMEDIATE), чтение в WAL не блокируется записью, ID выдаёт
+    AUTOINCREMENT и никогда не повторяет. Триггеры записывают ID изменённых
+    бронирований в booking_changes, по которым процессы обновляют свои индексы.
+    """
+
+    shared = True
+    # Сколько последних записей booking_changes хранить; отставшие процессы перечитывают всё
+    CHANGES_KEEP = 10000
+
+    # Поля, для которых в таблице есть отдельные колонки; остальное хранится в extra
+    COLUMNS = ('id', 'user_id', 'username', 'first_name', 'chat_id',
+               'location', 'date', 'time', 'people', 'status', 'timestamp')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            chat_id INTEGER,
+            location TEXT,
+            date TEXT,
+            time TEXT,
+            people TEXT,
+            status TEXT,
+            timestamp TEXT,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings(user_id, location, date, time);
+        CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings(date);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS booking_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            booking_id INTEGER NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS bookings_changes_insert AFTER INSERT ON bookings
+        WHEN NOT EXISTS (SELECT 1 FROM meta WHERE key = 'bulk') BEGIN
+            INSERT INTO booking_changes (booking_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS bookings_changes_update AFTER UPDATE ON bookings
+        WHEN NOT EXISTS (SELECT 1 FROM meta WHERE key = 'bulk') BEGIN
+            INSERT INTO booking_changes (booking_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS bookings_changes_delete AFTER DELETE ON bookings
+        WHEN NOT EXISTS (SELECT 1 FROM meta WHERE key = 'bulk') BEGIN
+            INSERT INTO booking_changes (booking_id) VALUES (OLD.id);
+        END;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Соединение используется из пула потоков, поэтому доступ сериализуем сами
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Пока другой процесс пишет, ждём, а не получаем «database is locked»
+        self._conn.execute("PRAGMA busy_timeout=10000")
+        self._conn.executescript(self.SCHEMA)
+        self._data_version = None
+        self._writes = 0
+
+    def _row_to_booking(self, row: sqlite3.Row) -> Dict[str, Any]:
+        booking = {key: row[key] for key in self.COLUMNS}
+        if row['extra']:
+            booking.update(json.loads(row['extra']))
+        return booking
+
+    def _booking_to_row(self, booking: Dict[str, Any]) -> tuple:
+        extra = {k: v for k, v in booking.items() if k not in self.COLUMNS}
+        return tuple(booking.get(key) for key in self.COLUMNS) + (
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    @staticmethod
+    def _row_bytes(row) -> int:
+        # Оценка объёма данных строки: SQLite не сообщает, сколько байт записал
+        return sum(len(str(v)) for v in row if v is not None)
+
+    def _insert_many(self, bookings: List[Dict[str, Any]]) -> None:
+        placeholders = ', '.join('?' * (len(self.COLUMNS) + 1))
+        rows = [self._booking_to_row(b) for b in bookings]
+        self._conn.executemany(
+            f"INSERT INTO bookings ({', '.join(self.COLUMNS)}, extra) VALUES ({placeholders})",
+            rows
+        )
+        metrics.inc('storage.bytes_written', sum(self._row_bytes(row) for row in rows))
+
+    def all(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM bookings ORDER BY id").fetchall()
+        metrics.inc('storage.bytes_read', sum(self._row_bytes(tuple(r)) for r in rows))
+        return [self._row_to_booking(r) for r in rows]
+
+    def get(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM bookings WHERE id = ?", (booking_id,)).fetchone()
+        return self._row_to_booking(row) if row else None
+
+    def by_date(self, date: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM bookings WHERE date = ? ORDER BY id", (date,)).fetchall()
+        return [self._row_to_booking(r) for r in rows]
+
+    def exists(self, user_id, location, date, time) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM bookings WHERE user_id = ? AND location = ? AND date = ? AND time = ? LIMIT 1",
+                (user_id, location, date, time)
+            ).fetchone()
+        return row is not None
+
+    def add(self, booking: Dict[str, Any]) -> Dict[str, Any]:
+        booking.pop('id', None)
+        row = self._booking_to_row(booking)[1:]
+        with self._lock:
+            cursor = self._conn.execute(
+                f"INSERT INTO bookings ({', '.join(self.COLUMNS[1:])}, extra) "
+                f"VALUES ({', '.join('?' * len(row))})",
+                row
+            )
+        booking['id'] = cursor.lastrowid
+        metrics.inc('storage.bytes_written', self._row_bytes(row))
+        self._count_write()
+        return booking
+
+    def update_status(self, booking_id: int, status: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("UPDATE bookings SET status = ? WHERE id = ?", (status, booking_id))
+        self._count_write()
+        return cursor.rowcount > 0
+
+    def update_status_many(self, booking_ids: List[int], status: str) -> List[int]:
+        found = set()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for start in range(0, len(booking_ids), 500):
+                    chunk = list(booking_ids[start:start + 500])
+                    marks = ', '.join('?' * len(chunk))
+                    found.update(row[0] for row in self._conn.execute(
+                        f"SELECT id FROM bookings WHERE id IN ({marks})", chunk
+                    ))
+                    self._conn.execute(f"UPDATE bookings SET status = ? WHERE id IN ({marks})", [status] + chunk)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._count_write()
+        return [booking_id for booking_id in booking_ids if booking_id in found]
+
+    def delete(self, booking_id: int) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
+        self._count_write()
+        return cursor.rowcount > 0
+
+    def _count_write(self) -> None:
+        self._writes += 1
+        self._prune_if_due()
+
+    def _prune_if_due(self) -> None:
+        # Внутри транзакции чистка откладывается до COMMIT
+        if self._writes >= 1000 and not self._conn.in_transaction:
+            self._writes = 0
+            self.prune_changes()
+
+    def _begin_bulk(self) -> None:
+        """Массовое изменение (внутри транзакции) не пишет booking_changes построчно"""
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bulk', '1')")
+
+    def _end_bulk(self) -> None:
+        """Вместо построчных изменений меняется поколение: другие процессы перечитают всё"""
+        self._conn.execute("DELETE FROM meta WHERE key = 'bulk'")
+        self._conn.execute("DELETE FROM booking_changes")
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def replace_all(self, bookings: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._begin_bulk()
+                self._conn.execute("DELETE FROM bookings")
+                self._insert_many(bookings)
+                self._end_bulk()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add_if_new(self, booking: Dict[str, Any], capacity: Optional[int],
+                   active_statuses: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        slot = (booking.get('user_id'), booking.get('location'), booking.get('date'), booking.get('time'))
+        with self._lock:
+            # BEGIN IMMEDIATE сразу берёт блокировку записи: между проверкой и вставкой
+            # другой процесс ничего не добавит
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute(
+                    "SELECT 1 FROM bookings WHERE user_id = ? AND location = ? AND date = ? AND time = ? LIMIT 1",
+                    slot
+                ).fetchone():
+                    self._conn.execute("ROLLBACK")
+                    return None
+                if capacity is not None:
+                    placeholders = ', '.join('?' * len(active_statuses))
+                    taken = self._conn.execute(
+                        f"SELECT COALESCE(SUM(CAST(people AS INTEGER)), 0) FROM bookings "
+                        f"WHERE date = ? AND location = ? AND time = ? AND status IN ({placeholders})",
+                        (slot[2], slot[1], slot[3]) + tuple(active_statuses)
+                    ).fetchone()[0]
+                    if taken + int(booking.get('people') or 0) > capacity:
+                        raise SlotFullError(f"Свободных мест: {max(capacity - taken, 0)}")
+                self.add(booking)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._prune_if_due()
+        return booking
+
+    def update_status_many_if_fits(self, booking_ids: List[int], status: str, capacity: Callable[[str], int],
+                                   active_statuses: Tuple[str, ...]) -> Tuple[List[int], List[int]]:
+        placeholders = ', '.join('?' * len(active_statuses))
+        taken: Dict[Tuple[str, str, str], int] = {}
+        updated, full = [], []
+        with self._lock:
+            # Как в add_if_new: места считаются и занимаются под одной блокировкой записи
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for booking_id in booking_ids:
+                    row = self._conn.execute(
+                        "SELECT location, date, time, people, status FROM bookings WHERE id = ?", (booking_id,)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    location, date, time, people, old_status = row
+                    if old_status not in active_statuses:
+                        departure = (location, date, time)
+                        if departure not in taken:
+                            taken[departure] = self._conn.execute(
+                                f"SELECT COALESCE(SUM(CAST(people AS INTEGER)), 0) FROM bookings "
+                                f"WHERE date = ? AND location = ? AND time = ? AND status IN ({placeholders})",
+                                (date, location, time) + tuple(active_statuses)
+                            ).fetchone()[0]
+                        people = int(people or 0)
+                        if taken[departure] + people > capacity(location):
+                            full.append(booking_id)
+                            continue
+                        taken[departure] += people
+                    self._conn.execute("UPDATE bookings SET status = ? WHERE id = ?", (status, booking_id))
+                    updated.append(booking_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._count_write()
+        return updated, full
+
+    def _cursor(self) -> Tuple[int, int]:
+        generation = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        seq = self._conn.execute("SELECT MAX(seq) FROM booking_changes").fetchone()[0]
+        return int(generation[0]) if generation else 0, seq or 0
+
+    def snapshot(self) -> Tuple[List[Dict[str, Any]], Tuple[int, int]]:
+        with self._lock:
+            # Одна читающая транзакция: курсор и данные из одного состояния базы
+            self._conn.execute("BEGIN")
+            try:
+                self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                cursor = self._cursor()
+                bookings = self.all()
+            finally:
+                self._conn.execute("COMMIT")
+        return bookings, cursor
+
+    def changes_since(self, cursor: Tuple[int, int]):
+        with self._lock:
+            # data_version меняется только после коммитов других соединений — проверка почти бесплатна
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return None
+            self._data_version = version
+            self._conn.execute("BEGIN")
+            try:
+                new_cursor = self._cursor()
+                generation, seq = cursor
+                if new_cursor[0] != generation:
+                    return new_cursor, None
+                first = self._conn.execute("SELECT MIN(seq) FROM booking_changes").fetchone()[0]
+                if first is not None and first > seq + 1:
+                    return new_cursor, None  # нужные записи уже удалены
+                ids = [row[0] for row in self._conn.execute(
+                    "SELECT DISTINCT booking_id FROM booking_changes WHERE seq > ?", (seq,)
+                )]
+                changed: Dict[int, Optional[Dict[str, Any]]] = dict.fromkeys(ids)
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    for row in self._conn.execute(
+                        f"SELECT * FROM bookings WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                    ):
+                        changed[row['id']] = self._row_to_booking(row)
+            finally:
+                self._conn.execute("COMMIT")
+        return new_cursor, changed
+
+    def prune_changes(self) -> None:
+        """Удаляет старые записи booking_changes"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM booking_changes WHERE seq <= (SELECT MAX(seq) FROM booking_changes) - ?",
+                (self.CHANGES_KEEP,)
+            )
+
+    def migrate_from_json(self, json_file: str) -> int:
+        """Однократно переносит бронирования из JSON-файла. Возвращает число перенесённых записей."""
+        with self._lock:
+            # Проверка внутри транзакции: процессы, запущенные одновременно, переносят данные один раз
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone():
+                    self._conn.execute("ROLLBACK")
+                    return 0
+                bookings = JsonFileStorage(json_file).all()
+                # ID сохраняются, AUTOINCREMENT продолжит нумерацию после максимального
+                self._begin_bulk()
+                self._insert_many(bookings)
+                self._end_bulk()
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (json_file,)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(bookings)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Режимы, которые понимает create_storage
+STORAGE_MODES = ('json', 'journal', 'sqlite', 'partitioned')
+
+
+_process_locks = []
+
+
+def lock_for_single_process(path: str) -> None:
+    """Не даёт второму процессу открыть файловое хранилище: оба перезаписывали бы файлы
+    и теряли чужие изменения. Блокировка держится до завершения процесса."""
+    if fcntl is None:
+        return
+    lock_file = open(path + '.lock', 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(
+            f"Хранилище {path} уже используется другим процессом. "
+            f"Для нескольких процессов используйте BOOKINGS_STORAGE=sqlite"
+        )
+    _process_locks.append(lock_file)
+
+
+def create_storage(mode: str, json_file: str, journal_file: str, db_file: str,
+                   journal_compact_every: int = 1000, partition_dir: str = "bookings_partitions",
+                   snapshot_file: Optional[str] = None) -> BookingStorage:
+    """Создаёт хранилище по названию режима: json, journal, sqlite или partitioned.
+
+    snapshot_file — двоичный снимок для режима journal (None — снимок в JSON).
+    """
+    if mode in ("json", "journal", "partitioned"):
+        lock_for_single_process(json_file)
+    if mode == "json":
+        return JsonFileStorage(json_file)
+    if mode == "journal":
+        from journal import BookingJournal
+        return BookingJournal(json_file, journal_file, journal_compact_every, snapshot_file)
+    if mode == "sqlite":
+        storage = SqliteStorage(db_file)
+        storage.migrate_from_json(json_file)
+        return storage
+    if mode == "partitioned":
+        from partitions import PartitionedStorage
+        storage = PartitionedStorage(partition_dir)
+        storage.migrate_from_json(json_file)
+        return storage
+    raise ValueError(f"Неизвестный режим хранения бронирований: {mode}")
@@ -0,0 +1,182 @@
+"""Стресс-тест хранилища бронирований: несколько процессов одновременно добавляют бронирования.
+
+Каждый процесс работает с общим каталогом данных через bookings.add_booking_if_new,
+пользователи и отправления пересекаются, чтобы процессы соперничали за одни и те же
+слоты и места. После завершения проверяется, что ID не повторяются и растут,
+нет двух бронирований одного пользователя на один слот, места на отправлении не
+превышены, а индексы всех процессов видят одинаковое число бронирований.
+
+Пример:
+    python3 stress_storage.py --processes 8 --bookings 500
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from queue import Empty
+from collections import Counter
+
+# Предел ожидания других процессов и результатов, с
+TIMEOUT = 300
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+from storage import STORAGE_MODES  # noqa: E402
+
+LOCATIONS = ("Вершины Феодосии", "Белая Скала")
+TIMES = ("08:00", "13:00")
+DATES = ("01.08.2030", "02.08.2030", "03.08.2030")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Стресс-тест хранилища несколькими процессами")
+    parser.add_argument('--processes', type=int, default=4, help="число процессов")
+    parser.add_argument('--bookings', type=int, default=300, help="попыток бронирования на процесс")
+    parser.add_argument('--users', type=int, default=200, help="число разных пользователей")
+    parser.add_argument('--capacity', type=int, default=40, help="мест на отправлении")
+    parser.add_argument('--storage', choices=STORAGE_MODES, default="sqlite", help="режим хранения")
+    parser.add_argument('--workdir', help="каталог данных (по умолчанию временный)")
+    return parser.parse_args()
+
+
+def worker(number: int, args, workdir: str, barrier, results) -> None:
+    try:
+        run_worker(number, args, workdir, barrier, results)
+    except Exception as e:
+        # Файловые режимы не допускают второй процесс, остальные ошибки тоже сообщаются
+        barrier.abort()
+        results.put((number, 'error', f"{type(e).__name__}: {e}"))
+
+
+def run_worker(number: int, args, workdir: str, barrier, results) -> None:
+    os.chdir(workdir)
+    os.environ["BOOKINGS_STORAGE"] = args.storage
+    import bookings
+    # Хранилище открывается до замера: файловые режимы здесь же откажут второму процессу
+    bookings.load_index()
+    rng = random.Random(number)
+    ids, duplicates, full = [], 0, 0
+    started = time.perf_counter()
+    for _ in range(args.bookings):
+        user_id = rng.randint(1, args.users)
+        booking = {
+            'location': rng.choice(LOCATIONS),
+            'date': rng.choice(DATES),
+            'time': rng.choice(TIMES),
+            'people': str(rng.randint(1, 4)),
+            'user_id': user_id,
+            'username': f"stress{user_id}",
+            'first_name': f"Процесс {number}",
+            'chat_id': user_id,
+        }
+        try:
+            saved = bookings.add_booking_if_new(booking, args.capacity)
+        except bookings.SlotFullError:
+            full += 1
+            continue
+        if saved is None:
+            duplicates += 1
+        else:
+            ids.append(saved['id'])
+    elapsed = time.perf_counter() - started
+    try:
+        barrier.wait(TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass
+    # Все процессы закончили запись: индекс каждого должен видеть все бронирования
+    seen = len(bookings.get_all_bookings())
+    bookings.close_storage()
+    results.put((number, 'ok', {'ids': ids, 'duplicates': duplicates, 'full': full,
+                                'elapsed': elapsed, 'seen': seen}))
+
+
+def check_database(path: str, capacity: int) -> list:
+    conn = sqlite3.connect(path)
+    problems = []
+    for row in conn.execute(
+        "SELECT user_id, location, date, time, COUNT(*) FROM bookings "
+        "GROUP BY user_id, location, date, time HAVING COUNT(*) > 1"
+    ):
+        problems.append(f"дубликат слота {row[:4]}: {row[4]} бронирования")
+    for row in conn.execute(
+        "SELECT location, date, time, SUM(CAST(people AS INTEGER)) FROM bookings "
+        "WHERE status IN ('new', 'confirmed') GROUP BY location, date, time"
+    ):
+        if row[3] > capacity:
+            problems.append(f"на отправлении {row[:3]} занято {row[3]} мест из {capacity}")
+    conn.close()
+    return problems
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="jeeptour-stress-")
+    os.makedirs(workdir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(args.processes)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(n, args, workdir, barrier, results))
+                 for n in range(args.processes)]
+    started = time.perf_counter()
+    for p in processes:
+        p.start()
+    reports = []
+    for _ in processes:
+        try:
+            reports.append(results.get(timeout=TIMEOUT))
+        except Empty:
+            break
+    for p in processes:
+        p.join(TIMEOUT)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+    elapsed = time.perf_counter() - started
+
+    errors = [(n, message) for n, status, message in reports if status == 'error']
+    reported = {n for n, _, _ in reports}
+    for n, p in enumerate(processes):
+        if n not in reported:
+            errors.append((n, f"нет результата, код завершения {p.exitcode}"))
+        elif p.exitcode != 0:
+            errors.append((n, f"код завершения {p.exitcode}"))
+    for n, message in errors:
+        print(f"Процесс {n}: {message}")
+    ok = [report for _, status, report in reports if status == 'ok']
+    all_ids = [i for report in ok for i in report['ids']]
+    problems = []
+    if len(all_ids) != len(set(all_ids)):
+        repeated = [i for i, c in Counter(all_ids).items() if c > 1]
+        problems.append(f"ID выданы повторно: {repeated[:10]}")
+    for report in ok:
+        if report['ids'] != sorted(report['ids']):
+            problems.append("ID в одном процессе не возрастают")
+        if report['seen'] != len(all_ids):
+            problems.append(f"индекс процесса видит {report['seen']} бронирований из {len(all_ids)}")
+    if args.storage == 'sqlite' and not errors:
+        # Как bookings.DB_FILE; процесс проверки сам хранилище не открывает
+        db_file = os.getenv("BOOKINGS_DB_FILE", "bookings.db")
+        problems += check_database(os.path.join(workdir, db_file), args.capacity)
+
+    print(f"Процессов: {args.processes}, хранилище: {args.storage}, время: {elapsed:.2f} с")
+    print(f"Создано бронирований: {len(all_ids)}, дубликатов отклонено: "
+          f"{sum(r['duplicates'] for r in ok)}, отказов из-за мест: {sum(r['full'] for r in ok)}")
+    if ok:
+        attempts = args.bookings * len(ok)
+        print(f"Попыток в секунду: {attempts / max(r['elapsed'] for r in ok):.0f}")
+    for problem in problems:
+        print("ОШИБКА:", problem)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if problems or errors else 0)
+
+
+if __name__ == '__main__':
+    main()
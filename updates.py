@@ -0,0 +1,162 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Collection, Dict, Hashable, Optional, Set
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from metrics import metrics
+from notifications import TokenBucket
+
+# Сколько обновлений обрабатывается одновременно; 1 — строго по одному, как раньше
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# Сколько обновлений принимается в обработку вместе с ждущими в очередях пользователей
+PENDING_UPDATES = int(os.getenv("PENDING_UPDATES", "1024"))
+
+# Ограничение частоты обновлений от одного пользователя: в секунду и про запас
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "8"))
+THROTTLE_ADMIN_RATE = float(os.getenv("THROTTLE_ADMIN_RATE", "10"))
+THROTTLE_ADMIN_BURST = float(os.getenv("THROTTLE_ADMIN_BURST", "30"))
+# Сколько пользователей помнить и через сколько секунд тишины забывать
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "10000"))
+THROTTLE_TTL = float(os.getenv("THROTTLE_TTL", "600"))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно, а одного — строго по порядку.
+
+    Для каждого пользователя (или чата, если пользователя нет) держится asyncio.Lock,
+    который удаляется, как только у пользователя не остаётся обновлений в обработке.
+    Семафор базового класса берётся до do_process_update и ограничивает принятые
+    обновления (PENDING_UPDATES), а лимит выполняемых CONCURRENT_UPDATES — свой
+    семафор, который занимается только после блокировки пользователя: очередь одного
+    пользователя ждёт свою блокировку, не занимая мест остальных. Если задан throttle,
+    обновления сверх лимита частоты отбрасываются ещё до очереди.
+    """
+
+    def __init__(self, max_concurrent_updates: int = CONCURRENT_UPDATES,
+                 throttle: Optional["UserThrottle"] = None,
+                 max_pending_updates: int = PENDING_UPDATES):
+        super().__init__(max(max_concurrent_updates, max_pending_updates))
+        self.throttle = throttle
+        self.max_running_updates = max_concurrent_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self.throttle is not None and not self.throttle.admit(update):
+            coroutine.close()
+            return
+        key = self._key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке очереди (FIFO)
+            async with lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class InFlight:
+    """Ключи операций, которые выполняются прямо сейчас (защита от повторных нажатий)"""
+
+    def __init__(self):
+        self._keys: Set[Hashable] = set()
+
+    def claim(self, key: Hashable) -> bool:
+        """Занимает ключ; False, если операция с этим ключом уже идёт"""
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+    def release(self, key: Hashable) -> None:
+        self._keys.discard(key)
+
+
+class UserThrottle:
+    """Ограничитель частоты обновлений на пользователя (token bucket).
+
+    Корзины хранятся в порядке последнего обращения: давно неактивные (TTL) и
+    лишние сверх max_users вытесняются с начала, поэтому память ограничена.
+    Проверяется в PerUserUpdateProcessor до очереди пользователя и лимита выполняемых.
+    """
+
+    def __init__(self, admin_ids: Collection[int] = (), rate: float = THROTTLE_RATE,
+                 burst: float = THROTTLE_BURST, admin_rate: float = THROTTLE_ADMIN_RATE,
+                 admin_burst: float = THROTTLE_ADMIN_BURST, max_users: int = THROTTLE_MAX_USERS,
+                 ttl: float = THROTTLE_TTL):
+        self.admin_ids = set(admin_ids)
+        self.rate = rate
+        self.burst = burst
+        self.admin_rate = admin_rate
+        self.admin_burst = admin_burst
+        self.max_users = max_users
+        self.ttl = ttl
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+    def _evict(self) -> None:
+        expired = time.monotonic() - self.ttl
+        while self._buckets:
+            user_id, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_users and bucket.updated >= expired:
+                break
+            del self._buckets[user_id]
+
+    def allow(self, user_id: int) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if user_id in self.admin_ids:
+                bucket = TokenBucket(self.admin_rate, capacity=self.admin_burst)
+            else:
+                bucket = TokenBucket(self.rate, capacity=self.burst)
+            self._buckets[user_id] = bucket
+            self._evict()
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket.try_acquire()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def admit(self, update: object) -> bool:
+        """False, если пользователь превысил лимит и обновление нужно отбросить.
+
+        Отброшенным нажатиям кнопок не отвечаем: лишний запрос к Telegram на каждое
+        из них нагружал бы бота тем сильнее, чем чаще нажимает пользователь.
+        """
+        if not isinstance(update, Update) or update.effective_user is None:
+            return True
+        if self.allow(update.effective_user.id):
+            return True
+        metrics.inc('throttle.dropped')
+        return False
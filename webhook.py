@@ -0,0 +1,260 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import signal
+from typing import Callable, Dict, List, Optional, Tuple
+from telegram import Update
+from telegram.ext import Application
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Публичный адрес за reverse proxy; если не задан, setWebhook не вызывается (локальная отладка)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Ограничения на разбор запроса и очередь обновлений
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", str(1024 * 1024)))
+MAX_QUEUE_SIZE = int(os.getenv("WEBHOOK_MAX_QUEUE", "10000"))
+READ_TIMEOUT = 10.0
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 408: "Request Timeout", 411: "Length Required",
+           413: "Payload Too Large", 431: "Request Header Fields Too Large",
+           503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class WebhookServer:
+    """Минимальный HTTP-сервер на asyncio для приёма обновлений Telegram.
+
+    Обновление подтверждается ответом 200 сразу после разбора JSON, а обработка
+    идёт через application.update_queue. GET /metrics отдаёт счётчики в формате Prometheus.
+    """
+
+    def __init__(self, application: Application, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.received = 0
+        self.rejected: Dict[int, int] = {}
+        self.max_queue_depth = 0
+        # Дополнительные источники метрик: функции, возвращающие строки в формате Prometheus
+        self.metrics_providers: List[Callable[[], List[str]]] = []
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        logger.info("Webhook-сервер слушает http://%s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # --- Разбор HTTP ---
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HttpError(431)
+        if not request_line:
+            return None
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise HttpError(400)
+        method, target, _ = parts
+
+        headers: Dict[str, str] = {}
+        header_bytes = len(request_line)
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise HttpError(408)
+            except (ValueError, asyncio.LimitOverrunError):
+                raise HttpError(431)
+            header_bytes += len(line)
+            if header_bytes > MAX_HEADER_BYTES:
+                raise HttpError(431)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if method == 'POST':
+            if 'transfer-encoding' in headers:
+                # Telegram всегда присылает Content-Length, chunked не поддерживаем
+                raise HttpError(411)
+            try:
+                length = int(headers.get('content-length', ''))
+            except ValueError:
+                raise HttpError(411)
+            if length < 0 or length > MAX_BODY_BYTES:
+                raise HttpError(413)
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                raise HttpError(408)
+        return method, target.split('?', 1)[0], headers, body
+
+    @staticmethod
+    def _response(writer: asyncio.StreamWriter, status: int, body: bytes = b'',
+                  content_type: str = 'text/plain; charset=utf-8', keep_alive: bool = True) -> None:
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as e:
+                    self.rejected[e.status] = self.rejected.get(e.status, 0) + 1
+                    self._response(writer, e.status, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, response_body, content_type = self._dispatch(method, path, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self._response(writer, status, response_body, content_type, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, bytes, str]:
+        if path == '/metrics' and method == 'GET':
+            return 200, self.render_metrics().encode('utf-8'), 'text/plain; version=0.0.4'
+        status = self._accept_update(method, path, headers, body)
+        if status != 200:
+            self.rejected[status] = self.rejected.get(status, 0) + 1
+        return status, b'', 'text/plain; charset=utf-8'
+
+    def _accept_update(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        if path != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if self.secret and not hmac.compare_digest(
+            headers.get('x-telegram-bot-api-secret-token', ''), self.secret
+        ):
+            return 403
+        queue = self.application.update_queue
+        if queue.qsize() >= MAX_QUEUE_SIZE:
+            # Telegram повторит доставку позже
+            return 503
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(payload, dict):
+            return 400
+        try:
+            update = Update.de_json(payload, self.application.bot)
+        except Exception:
+            # Тело — JSON, но не обновление Telegram (например, {"message": 5})
+            return 400
+        if update is None:
+            return 400
+        # Подтверждаем сразу: обработка идёт через очередь приложения
+        queue.put_nowait(update)
+        self.received += 1
+        self.max_queue_depth = max(self.max_queue_depth, queue.qsize())
+        return 200
+
+    def render_metrics(self) -> str:
+        lines = [
+            "# TYPE webhook_updates_received_total counter",
+            f"webhook_updates_received_total {self.received}",
+            "# TYPE webhook_requests_rejected_total counter",
+        ]
+        lines += [f'webhook_requests_rejected_total{{status="{status}"}} {count}'
+                  for status, count in sorted(self.rejected.items())]
+        lines += [
+            "# TYPE webhook_update_queue_depth gauge",
+            f"webhook_update_queue_depth {self.application.update_queue.qsize()}",
+            "# TYPE webhook_update_queue_depth_max gauge",
+            f"webhook_update_queue_depth_max {self.max_queue_depth}",
+        ]
+        for provider in self.metrics_providers:
+            lines += provider()
+        return "\n".join(lines) + "\n"
+
+
+def is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+async def run_webhook(application: Application, set_webhook: bool = True) -> None:
+    """Запускает бота в режиме webhook до SIGINT/SIGTERM"""
+    # Без секрета любой, кто достучится до порта, может прислать обновление от имени админа
+    if not WEBHOOK_SECRET and (WEBHOOK_URL or not is_loopback(WEBHOOK_HOST)):
+        raise RuntimeError(
+            "WEBHOOK_SECRET не задан. Без секрета webhook-сервер запускается только "
+            "на локальном адресе и без WEBHOOK_URL"
+        )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    server = WebhookServer(application)
+    server.metrics_providers.append(metrics.render_prometheus)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.start()
+        if set_webhook and WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await server.start()
+        await stop.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)